@@ -5,11 +5,10 @@ Amazon / 楽天市場 / Yahoo!ショッピング
 """
 
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import numpy as np
+import malls
+import profiling
+from defaults import (DEFAULT_PARAMS, DEFAULT_SEASONALITY, LARGE_N_PLANS, PLAN_PRESETS, plan_color_map,
+                      reference_index)
 
 # ══════════════════════════════════════════════
 # Page Config
@@ -21,6 +20,18 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+# 計測（?debug=1 のときのみ有効。無効時は何もしない）
+# 前回の rerun が finish() まで届かなかった場合（途中の再実行・st.rerun・st.stop）のサンプラーはここで止める
+if "_prof" in st.session_state:
+    st.session_state.pop("_prof").close()
+prof = profiling.Profiler(enabled=profiling.is_debug(st.query_params),
+                          sampling=st.session_state.get("prof_sampling", False))
+if prof.enabled:
+    st.session_state["_prof"] = prof
+prof.lap("layout")
+plotly_chart = prof.wrap(st.plotly_chart, "st.plotly_chart")
+dataframe = prof.wrap(st.dataframe, "st.dataframe")
+
 # ══════════════════════════════════════════════
 # Session State
 # ══════════════════════════════════════════════
@@ -29,20 +40,61 @@ if "show_onboarding" not in st.session_state:
 if "onboarding_step" not in st.session_state:
     st.session_state["onboarding_step"] = 0
 
+# 実績データからの推定値で上書きできる入力（ウィジェットは key で参照し、初期値はここで与える）
+CALIBRATED_DEFAULTS = {
+    **{k: DEFAULT_PARAMS[k] for k in ("average_order_value", "organic_traffic_base", "base_cvr", "target_cpc")},
+    **{f"season_{i}": v for i, v in enumerate(DEFAULT_SEASONALITY)},
+}
+# 推定直後の rerun でウィジェット生成前に反映する
+st.session_state.update(st.session_state.pop("_calibrated_values", {}))
+for k, v in CALIBRATED_DEFAULTS.items():
+    st.session_state.setdefault(k, v)
+
 # ══════════════════════════════════════════════
-# Plan color constants
+# Plan constants
 # ══════════════════════════════════════════════
-PLAN_COLORS = {
-    "🥈 シルバー": "#94a3b8",
-    "🥇 ゴールド": "#f59e0b",
-    "💎 プラチナ": "#6366f1",
-}
+PLAN_CARD_CLASS = {"🥈 シルバー": "plan-card-silver", "🥇 ゴールド": "plan-card-gold", "💎 プラチナ": "plan-card-platinum"}
+MAX_PLANS = 50
+
+def budget_column(mall):
+    return f"{mall} 予算 (円/月)"
+
+# モール別予算の列は全モール分を持ち、表示だけ選択中のモールに絞る（モールを切り替えても編集が残る）
+PLAN_TABLE_COLUMNS = ["プラン", "広告倍率", "CVR補正", "流入補正"] + [budget_column(m) for m in malls.MALLS]
+
+def new_plan_table(rows):
+    """Nプラン比較モードの編集表（数値列は float。モール別予算の空欄は NaN）"""
+    import pandas as pd
+    return pd.DataFrame(rows, columns=PLAN_TABLE_COLUMNS).astype({c: float for c in PLAN_TABLE_COLUMNS[1:]})
+
+def plan_table_configs(rows, names):
+    """プラン表の行（dict のリスト）→ {プラン名: (広告倍率, CVR補正, 流入補正, {モール: 月間予算})}
+
+    空の名前・重複した名前の行は除き、MAX_PLANS 件までにする。除いた行の説明を 2 番目に返す。
+    """
+    def num(v, default):
+        return default if v is None or v != v else float(v)
+
+    configs, skipped = {}, []
+    for r in rows:
+        name = r["プラン"].strip() if isinstance(r.get("プラン"), str) else ""
+        if not name or name in configs:
+            skipped.append(name or "（名前なし）")
+            continue
+        budgets = {m: num(r.get(budget_column(m)), None) for m in names}
+        configs[name] = (num(r.get("広告倍率"), 1.0), num(r.get("CVR補正"), 1.0), num(r.get("流入補正"), 1.0),
+                         {m: b for m, b in budgets.items() if b is not None})
+    if len(configs) > MAX_PLANS:
+        skipped += list(configs)[MAX_PLANS:]
+        configs = dict(list(configs.items())[:MAX_PLANS])
+    return configs, skipped
+
 PLAN_BG = {
     "🥈 シルバー": "#f1f5f9",
     "🥇 ゴールド": "#fffbeb",
     "💎 プラチナ": "#eef2ff",
 }
-ALL_MALL_COLORS = {"Amazon": "#FF9900", "楽天市場": "#BF0000", "Yahoo!": "#FF0033"}
+ALL_MALL_COLORS = {name: spec["color"] for name, spec in malls.MALLS.items()}
 
 # ══════════════════════════════════════════════
 # CSS
@@ -164,19 +216,18 @@ st.markdown("""
 # ══════════════════════════════════════════════
 # Sidebar
 # ══════════════════════════════════════════════
+prof.lap("sidebar")
 with st.sidebar:
     st.markdown("### ⚙️ シミュレーション設定")
 
     # ── Mall Selection ──
     with st.expander("🏬 参画モール選択", expanded=True):
         st.caption("対象モールを選択してください。")
-        use_amazon = st.checkbox("🟠 Amazon", value=True, key="use_amazon")
-        use_rakuten = st.checkbox("🔴 楽天市場", value=True, key="use_rakuten")
-        use_yahoo = st.checkbox("🔵 Yahoo!ショッピング", value=True, key="use_yahoo")
-        active_malls = []
-        if use_amazon: active_malls.append("Amazon")
-        if use_rakuten: active_malls.append("楽天市場")
-        if use_yahoo: active_malls.append("Yahoo!")
+        active_malls = [name for name, spec in malls.MALLS.items()
+                        if st.checkbox(spec["label"], value=spec["default"], key=spec["key"])]
+        use_amazon = "Amazon" in active_malls
+        use_rakuten = "楽天市場" in active_malls
+        use_yahoo = "Yahoo!" in active_malls
         if not active_malls:
             st.error("⚠️ 最低1つのモールを選択してください。")
             active_malls = ["Amazon"]
@@ -184,10 +235,12 @@ with st.sidebar:
     # ── Simulation Mode ──
     with st.expander("📊 シミュレーションモード", expanded=True):
         sim_mode = st.radio(
-            "モード選択", ["単一プラン（従来モード）", "3プラン比較モード"],
-            help="3プラン比較では、シルバー/ゴールド/プラチナの3パターンを同時シミュレーションします。",
+            "モード選択", ["単一プラン（従来モード）", "3プラン比較モード", "Nプラン比較モード（カスタム）"],
+            help="3プラン比較では、シルバー/ゴールド/プラチナの3パターンを同時シミュレーションします。"
+                 f"Nプラン比較では、最大{MAX_PLANS}プランを表で定義できます（モール別の広告予算も指定可）。",
         )
-        is_multi_plan = sim_mode == "3プラン比較モード"
+        is_multi_plan = sim_mode != "単一プラン（従来モード）"
+        is_custom_plans = sim_mode == "Nプラン比較モード（カスタム）"
 
     # ── Basic Settings ──
     with st.expander("🏪 STEP1: 基本設定", expanded=True):
@@ -195,86 +248,194 @@ with st.sidebar:
             "現状月商 (円)", min_value=0, value=5_000_000, step=100_000, format="%d",
             help="クライアントの直近3ヶ月の平均月商を入力してください。")
         average_order_value = st.number_input(
-            "客単価 (円)", min_value=1, value=5_000, step=100, format="%d",
+            "客単価 (円)", min_value=1, step=100, format="%d", key="average_order_value",
             help="1注文あたりの平均購入金額。")
-        cogs_rate = st.slider("原価率", 0.0, 1.0, 0.30, 0.01, format="%.2f",
+        cogs_rate = st.slider("原価率", 0.0, 1.0, DEFAULT_PARAMS["cogs_rate"], 0.01, format="%.2f",
             help="商品仕入原価 ÷ 売上。EC物販は0.25〜0.40が目安。")
         organic_traffic_base = st.number_input(
-            "月間自然流入数 (UU)", min_value=0, value=30_000, step=1_000, format="%d",
+            "月間自然流入数 (UU)", min_value=0, step=1_000, format="%d", key="organic_traffic_base",
             help="広告を除いた自然検索等のアクセス数。")
-        base_cvr = st.slider("基礎転換率", 0.001, 0.10, 0.02, 0.001, format="%.3f",
+        base_cvr = st.slider("基礎転換率", 0.001, 0.10, step=0.001, format="%.3f", key="base_cvr",
             help="購入数÷アクセス数。平均1〜3%。")
 
     # ── Marketing Settings ──
     with st.expander("📣 STEP2: マーケティング設定", expanded=True):
         ad_budget_monthly = st.number_input(
-            "月間広告予算 (円)", min_value=0, value=500_000, step=50_000, format="%d",
+            "月間広告予算 (円)", min_value=0, value=DEFAULT_PARAMS["ad_budget_monthly"], step=50_000, format="%d",
             help="月間広告投下額。3プランモードではゴールドの基準額になります。")
         target_cpc = st.number_input(
-            "想定CPC (円)", min_value=1, value=50, step=5, format="%d",
+            "想定CPC (円)", min_value=1, step=5, format="%d", key="target_cpc",
             help="広告1クリックあたりの費用。")
         expected_roas = st.slider("目標ROAS (倍)", 0.5, 10.0, 3.0, 0.1, format="%.1f")
 
     # ── Mall Specific ──
     if use_amazon:
         with st.expander("🟠 STEP3-a: Amazon 固有設定"):
-            buy_box_pct = st.slider("カート取得率", 0.0, 1.0, 0.90, 0.01, format="%.2f",
+            buy_box_pct = st.slider("カート取得率", 0.0, 1.0, DEFAULT_PARAMS["buy_box_pct"], 0.01, format="%.2f",
                 help="Buy Box獲得割合。")
-            fba_usage = st.slider("FBA利用率", 0.0, 1.0, 0.80, 0.01, format="%.2f")
-            prime_day_boost = st.slider("プライムデー跳ね上げ率 (7月)", 1.0, 5.0, 2.5, 0.1, format="%.1f")
+            fba_usage = st.slider("FBA利用率", 0.0, 1.0, DEFAULT_PARAMS["fba_usage"], 0.01, format="%.2f")
+            prime_day_boost = st.slider("プライムデー跳ね上げ率 (7月)", 1.0, 5.0, DEFAULT_PARAMS["prime_day_boost"], 0.1, format="%.1f")
     else:
-        buy_box_pct, fba_usage, prime_day_boost = 0.90, 0.80, 2.5
+        buy_box_pct, fba_usage, prime_day_boost = (DEFAULT_PARAMS[k] for k in ("buy_box_pct", "fba_usage", "prime_day_boost"))
 
     if use_rakuten:
         with st.expander("🔴 STEP3-b: 楽天 固有設定"):
-            ss_boost = st.slider("楽天SS跳ね上げ率 (3,6,9,12月)", 1.0, 5.0, 3.0, 0.1, format="%.1f")
-            point_mult = st.slider("店舗負担ポイント倍率", 1.0, 10.0, 5.0, 0.5, format="%.1f")
+            ss_boost = st.slider("楽天SS跳ね上げ率 (3,6,9,12月)", 1.0, 5.0, DEFAULT_PARAMS["ss_boost"], 0.1, format="%.1f")
+            point_mult = st.slider("店舗負担ポイント倍率", 1.0, 10.0, DEFAULT_PARAMS["point_mult"], 0.5, format="%.1f")
     else:
-        ss_boost, point_mult = 3.0, 5.0
+        ss_boost, point_mult = DEFAULT_PARAMS["ss_boost"], DEFAULT_PARAMS["point_mult"]
 
     if use_yahoo:
         with st.expander("🔵 STEP3-c: Yahoo! 固有設定"):
-            five_day_boost = st.slider("5のつく日係数", 1.0, 3.0, 1.5, 0.1, format="%.1f")
-            pr_option_rate = st.slider("PRオプション料率", 0.0, 0.30, 0.05, 0.01, format="%.2f")
+            five_day_boost = st.slider("5のつく日係数", 1.0, 3.0, DEFAULT_PARAMS["five_day_boost"], 0.1, format="%.1f")
+            pr_option_rate = st.slider("PRオプション料率", 0.0, 0.30, DEFAULT_PARAMS["pr_option_rate"], 0.01, format="%.2f")
     else:
-        five_day_boost, pr_option_rate = 1.5, 0.05
+        five_day_boost, pr_option_rate = DEFAULT_PARAMS["five_day_boost"], DEFAULT_PARAMS["pr_option_rate"]
 
     # ── Seasonality ──
     with st.expander("📅 季節指数 (月別)"):
         st.caption("1.0 = 平月。1.5 = 50%増。0.8 = 20%減。")
-        default_seasonality = [0.9, 0.8, 1.2, 1.0, 1.0, 1.3, 1.2, 0.9, 1.2, 1.0, 1.1, 1.5]
         month_labels = ["1月","2月","3月","4月","5月","6月","7月","8月","9月","10月","11月","12月"]
         seasonality = []
         scols = st.columns(2)
         for i in range(12):
             with scols[i % 2]:
-                val = st.number_input(month_labels[i], 0.1, 5.0, default_seasonality[i], 0.1,
-                    format="%.1f", key=f"season_{i}")
+                val = st.number_input(month_labels[i], 0.1, 5.0, step=0.1,
+                    format="%.2f", key=f"season_{i}")
                 seasonality.append(val)
 
-    # ── Plan Settings (3-plan mode only) ──
-    if is_multi_plan:
+    # ── Plan Settings (multi-plan modes only) ──
+    if is_custom_plans:
+        with st.expander("📋 STEP4: プラン設定（Nプラン）", expanded=True):
+            st.caption("1行 = 1プラン。倍率は月間広告予算・基礎転換率・自然流入に掛かります。"
+                       "モール別予算を入れたモールは、倍率ではなくその月額で出稿します。")
+            gc1, gc2 = st.columns(2)
+            gen_n = gc1.number_input("生成するプラン数", 2, MAX_PLANS, 10, key="plan_gen_n")
+            gen_lo, gen_hi = gc2.slider("広告倍率の範囲", 0.0, 10.0, (0.5, 3.0), 0.1, key="plan_gen_range")
+            if st.button("📐 広告倍率を等間隔で生成", use_container_width=True):
+                step_ = (gen_hi - gen_lo) / (gen_n - 1)
+                st.session_state["plan_table"] = new_plan_table(
+                    [{"プラン": f"プラン{i + 1:02d}（広告×{gen_lo + step_ * i:.2f}）", "広告倍率": gen_lo + step_ * i,
+                      "CVR補正": 1.0, "流入補正": 1.0} for i in range(gen_n)])
+                st.session_state["plan_table_ver"] = st.session_state.get("plan_table_ver", 0) + 1
+            plan_table = st.session_state.setdefault("plan_table", new_plan_table(
+                [{"プラン": k, "広告倍率": v[0], "CVR補正": v[1], "流入補正": v[2]} for k, v in PLAN_PRESETS.items()]))
+            edited_plans = st.data_editor(
+                plan_table, key=f"plan_editor_{st.session_state.get('plan_table_ver', 0)}",
+                num_rows="dynamic", hide_index=True, use_container_width=True,
+                column_order=PLAN_TABLE_COLUMNS[:4] + [budget_column(m) for m in active_malls],
+                column_config={
+                    "プラン": st.column_config.TextColumn(required=True),
+                    "広告倍率": st.column_config.NumberColumn(min_value=0.0, max_value=20.0, step=0.1, format="%.2f"),
+                    "CVR補正": st.column_config.NumberColumn(min_value=0.1, max_value=5.0, step=0.05, format="%.2f"),
+                    "流入補正": st.column_config.NumberColumn(min_value=0.1, max_value=5.0, step=0.05, format="%.2f"),
+                    **{budget_column(m): st.column_config.NumberColumn(min_value=0, step=50_000, format="%d")
+                       for m in malls.MALLS},
+                })
+            custom_plans, skipped_plans = plan_table_configs(edited_plans.to_dict("records"), active_malls)
+            if skipped_plans:
+                st.warning(f"⚠️ 次の行は除外しました（名前なし・重複・{MAX_PLANS}件超）: {'、'.join(skipped_plans[:5])}"
+                           + (" ほか" if len(skipped_plans) > 5 else ""))
+            if not custom_plans:
+                st.error("⚠️ プランを1つ以上入力してください。")
+                custom_plans = dict(PLAN_PRESETS)
+        plan_names = list(custom_plans)
+    elif is_multi_plan:
         with st.expander("📋 STEP4: プラン設定", expanded=True):
             st.caption("各プランの倍率を調整。ゴールドが基準（×1.0）です。")
+            silver, gold, plat = PLAN_PRESETS.values()
 
             st.markdown("**🥈 シルバー（現状維持）**")
-            silver_ad = st.slider("広告予算倍率", 0.1, 2.0, 0.5, 0.1, key="s_ad", format="%.1f")
-            silver_cvr = st.slider("CVR補正", 0.8, 1.5, 1.00, 0.05, key="s_cvr", format="%.2f")
-            silver_trf = st.slider("流入補正", 0.8, 2.0, 1.00, 0.05, key="s_trf", format="%.2f")
+            silver_ad = st.slider("広告予算倍率", 0.1, 2.0, silver[0], 0.1, key="s_ad", format="%.1f")
+            silver_cvr = st.slider("CVR補正", 0.8, 1.5, silver[1], 0.05, key="s_cvr", format="%.2f")
+            silver_trf = st.slider("流入補正", 0.8, 2.0, silver[2], 0.05, key="s_trf", format="%.2f")
 
             st.markdown("**🥇 ゴールド（成長投資）**")
-            gold_ad = st.slider("広告予算倍率", 0.5, 3.0, 1.0, 0.1, key="g_ad", format="%.1f")
-            gold_cvr = st.slider("CVR補正", 0.8, 1.5, 1.05, 0.05, key="g_cvr", format="%.2f")
-            gold_trf = st.slider("流入補正", 0.8, 2.0, 1.10, 0.05, key="g_trf", format="%.2f")
+            gold_ad = st.slider("広告予算倍率", 0.5, 3.0, gold[0], 0.1, key="g_ad", format="%.1f")
+            gold_cvr = st.slider("CVR補正", 0.8, 1.5, gold[1], 0.05, key="g_cvr", format="%.2f")
+            gold_trf = st.slider("流入補正", 0.8, 2.0, gold[2], 0.05, key="g_trf", format="%.2f")
 
             st.markdown("**💎 プラチナ（攻めの投資）**")
-            plat_ad = st.slider("広告予算倍率", 1.0, 5.0, 2.0, 0.1, key="p_ad", format="%.1f")
-            plat_cvr = st.slider("CVR補正", 0.8, 2.0, 1.15, 0.05, key="p_cvr", format="%.2f")
-            plat_trf = st.slider("流入補正", 0.8, 3.0, 1.25, 0.05, key="p_trf", format="%.2f")
-    else:
-        silver_ad, silver_cvr, silver_trf = 0.5, 1.0, 1.0
-        gold_ad, gold_cvr, gold_trf = 1.0, 1.05, 1.1
-        plat_ad, plat_cvr, plat_trf = 2.0, 1.15, 1.25
+            plat_ad = st.slider("広告予算倍率", 1.0, 5.0, plat[0], 0.1, key="p_ad", format="%.1f")
+            plat_cvr = st.slider("CVR補正", 0.8, 2.0, plat[1], 0.05, key="p_cvr", format="%.2f")
+            plat_trf = st.slider("流入補正", 0.8, 3.0, plat[2], 0.05, key="p_trf", format="%.2f")
+
+        plan_names = list(PLAN_PRESETS)
+
+    if is_multi_plan:
+        with st.expander("🏆 比較基準・推奨ルール"):
+            base_plan = st.selectbox("比較元プラン", plan_names, index=0,
+                help="投資対効果（追加投資・追加売上）と推奨判定の比較元。")
+            ref_plan = st.selectbox("基準プラン", plan_names,
+                index=reference_index(plan_names),
+                help="プランカードの増減率・利益率・コスト構成の基準。")
+            st.caption("すべての条件を満たすプランから推奨を選びます。")
+            rule_profit = st.checkbox("限界利益が黒字", value=True, key="rule_profit")
+            rule_inc_roas = st.number_input("追加投資ROAS 下限 (倍)", 0.0, 50.0, 3.0, 0.5, format="%.1f", key="rule_inc_roas")
+            rule_profit_rate = st.number_input("利益率 下限 (%)", -100.0, 100.0, 15.0, 1.0, format="%.0f", key="rule_profit_rate")
+            rank_by = st.selectbox("候補の優先順", ["order", "profit", "inc_roi", "profit_rate", "sales"],
+                format_func=lambda k: {"order": "表の下の行から" if is_custom_plans else "プラチナ → ゴールド", "profit": "限界利益", "inc_roi": "追加投資の回収倍率",
+                                       "profit_rate": "利益率", "sales": "売上"}[k], key="rule_rank_by")
+        rec_rules = ([{"metric": "profit", "op": ">", "value": 0}] if rule_profit else []) + [
+            {"metric": "inc_roas", "op": ">=", "value": rule_inc_roas},
+            {"metric": "profit_rate", "op": ">=", "value": rule_profit_rate},
+        ]
+    if not is_multi_plan or is_custom_plans:
+        (silver_ad, silver_cvr, silver_trf), (gold_ad, gold_cvr, gold_trf), (plat_ad, plat_cvr, plat_trf) = PLAN_PRESETS.values()
+
+    # ── Repeat purchase & LTV (optional) ──
+    with st.expander("👥 リピート購入・LTV（オプション）"):
+        use_cohort = st.checkbox("リピート購入を考慮する", value=False, key="cohort_enabled",
+            help="毎月の注文を新規顧客とみなし、獲得月ごとのコホートにリテンションを適用してリピート売上とLTVを計算します。")
+        cohort_settings = None
+        if use_cohort:
+            import cohort
+            d = cohort.DEFAULTS
+            cohort_settings = {
+                "repeat_rate": st.slider("1ヶ月後リピート率", 0.0, 0.5, d["repeat_rate"], 0.01, format="%.2f",
+                    help="獲得した新規顧客のうち、翌月に再購入する割合。"),
+                "decay": st.slider("リテンション減衰", 0.0, 2.0, d["decay"], 0.1, format="%.1f",
+                    help="大きいほど時間とともにリピート率が早く低下。"),
+                "repeat_aov_mult": st.slider("リピート客単価倍率", 0.5, 2.0, d["repeat_aov_mult"], 0.05, format="%.2f"),
+                "ltv_months": st.number_input("LTV算出期間 (ヶ月)", 1, 120, d["ltv_months"], 6, format="%d"),
+                "prime_share": st.slider("Prime会員比率 (Amazon)", 0.0, 1.0, d["prime_share"], 0.05, format="%.2f",
+                    help="Prime会員が多いほどAmazonのリピート率が上昇。楽天はポイント倍率が高いほど上昇。"),
+            }
+
+    # ── Inventory & Cash Flow (optional) ──
+    with st.expander("📦 在庫・キャッシュフロー（オプション）"):
+        use_inventory = st.checkbox("在庫・入金サイトを考慮する", value=False, key="inv_enabled",
+            help="欠品による機会損失・FBA保管料・モール別の入金サイトを反映し、月末現預金を計算します。")
+        inv_settings = None
+        if use_inventory:
+            import inventory
+            d = inventory.DEFAULTS
+            sku_max = min(100_000, inventory.max_skus(len(plan_names) if is_multi_plan else 1, len(active_malls)))
+            inv_settings = {
+                "n_skus": st.number_input("SKU数", 1, sku_max, min(d["n_skus"], sku_max), 10, format="%d",
+                    help=f"プラン数 × モール数 × SKU数 は {inventory.MAX_CELLS:,} までです。"),
+                "sku_skew": st.slider("売れ筋集中度", 0.0, 2.0, d["sku_skew"], 0.1, format="%.1f",
+                    help="0 = 全SKU均等。大きいほど上位SKUに需要が集中。"),
+                "initial_months": st.slider("初期在庫 (ヶ月分)", 0.0, 6.0, d["initial_months"], 0.5, format="%.1f"),
+                "reorder_months": st.slider("発注点 (ヶ月分)", 0.0, 6.0, d["reorder_months"], 0.5, format="%.1f",
+                    help="在庫＋発注残がこの水準を下回ったら発注。"),
+                "order_up_to_months": st.slider("発注上限 (ヶ月分)", 0.5, 12.0, d["order_up_to_months"], 0.5, format="%.1f"),
+                "lead_time": st.number_input("追加リードタイム (ヶ月)", 0, 6, d["lead_time"], 1, format="%d",
+                    help="0 = 月末発注・翌月初入荷。"),
+                "storage_fee": st.number_input("FBA保管料 (円/個/月)", 0, 10_000, d["storage_fee"], 10, format="%d"),
+                "opening_cash": st.number_input("期首現預金 (円)", 0, None, d["opening_cash"], 1_000_000, format="%d"),
+            }
+
+    # ── Calibration from actuals (optional) ──
+    with st.expander("📂 実績データから推定（オプション）"):
+        st.caption("モール管理画面（RMS / Seller Central / ストアクリエイター）の月次・日次実績CSVから、"
+                   "基礎転換率・CPC・自然流入数・季節指数を推定して上の入力欄に反映します。")
+        actuals_files = st.file_uploader("実績CSV（複数可）", type="csv", accept_multiple_files=True,
+            key="actuals_files", help="年月・売上の列が必須。アクセス数・広告費・注文数の列があれば推定に使います。")
+        calib_requested = st.button("🎯 実績にフィット", disabled=not actuals_files, use_container_width=True)
+        calib = st.session_state.get("calibration")
+        if calib:
+            st.caption(f"前回の推定: R² {calib['r2']:.3f} ／ MAPE {calib['mape']:.1f}%（{', '.join(calib['report']['モール'])}）")
 
     # ── Re-show guide ──
     st.markdown("---")
@@ -324,293 +485,348 @@ if st.session_state["show_onboarding"]:
         st.session_state["show_onboarding"] = False
         st.rerun()
 
+# ══════════════════════════════════════════════
+# Deferred imports
+# ══════════════════════════════════════════════
+# pandas / plotly はヘッダー・サイドバー・ガイドの描画後に読み込む。
+# ワーカーのコールドスタート時も最初の画面が先に表示される。
+prof.lap("imports")
+import pandas as pd
+import plotly.express as px
+import engine
+import result_cache
+
 # ══════════════════════════════════════════════
 # Simulation Engine
 # ══════════════════════════════════════════════
-def run_sim(plan_name, ad_mult, cvr_mult, trf_mult):
-    """Run 12-month simulation for a given plan and all active malls."""
-    records = []
-    plan_ad = ad_budget_monthly * ad_mult
-    plan_organic = organic_traffic_base * trf_mult
-    plan_cvr_base = base_cvr * cvr_mult
-    ad_traffic = (plan_ad / target_cpc) if target_cpc > 0 else 0
-
-    for m_idx in range(12):
-        mn = m_idx + 1
-        si = seasonality[m_idx]
-        organic = plan_organic * si
-        base_traffic = organic + ad_traffic
-
-        for mall in active_malls:
-            traffic = base_traffic
-            if mall == "Amazon" and mn == 7: traffic *= prime_day_boost
-            elif mall == "楽天市場" and mn in (3,6,9,12): traffic *= ss_boost
-            elif mall == "Yahoo!": traffic *= five_day_boost
-
-            cvr = plan_cvr_base * (1 + point_mult * 0.01) * (1 + fba_usage * 0.1)
-            bb = buy_box_pct if mall == "Amazon" else 1.0
-            sales = traffic * cvr * average_order_value * bb
-            cogs = sales * cogs_rate
-            if mall == "Amazon": fr = 0.10
-            elif mall == "楽天市場": fr = 0.06
-            else: fr = 0.03 + pr_option_rate
-            fee = sales * fr
-            profit = sales - cogs - fee - plan_ad
-
-            records.append({
-                "プラン": plan_name, "月": month_labels[m_idx], "月番号": mn,
-                "モール": mall, "季節指数": si,
-                "アクセス数": int(round(traffic)), "CVR": round(cvr, 4),
-                "売上 (円)": round(sales), "原価 (円)": round(cogs),
-                "モール手数料 (円)": round(fee), "広告費 (円)": round(plan_ad),
-                "限界利益 (円)": round(profit), "手数料率": fr,
-            })
-    return records
+prof.lap("simulation")
+sim_params = {
+    "active_malls": active_malls, "seasonality": seasonality,
+    "ad_budget_monthly": ad_budget_monthly, "target_cpc": target_cpc,
+    "organic_traffic_base": organic_traffic_base, "base_cvr": base_cvr,
+    "average_order_value": average_order_value, "cogs_rate": cogs_rate,
+    "buy_box_pct": buy_box_pct, "fba_usage": fba_usage, "prime_day_boost": prime_day_boost,
+    "ss_boost": ss_boost, "point_mult": point_mult,
+    "five_day_boost": five_day_boost, "pr_option_rate": pr_option_rate,
+    "cohort": cohort_settings, "inventory": inv_settings,
+}
+
+# ── 実績データへのフィット（推定値はウィジェットに反映して再実行） ──
+if calib_requested:
+    import calibration
+    try:
+        calib = calibration.fit(calibration.load_actuals(actuals_files), sim_params)
+    except ValueError as e:
+        st.sidebar.error(f"⚠️ 実績データを読み込めません: {e}")
+    else:
+        fitted = calib["params"]
+        st.session_state["calibration"] = calib
+        st.session_state["_calibrated_values"] = {
+            "base_cvr": round(min(max(fitted["base_cvr"], 0.001), 0.10), 3),
+            "target_cpc": max(int(round(fitted["target_cpc"])), 1),
+            "organic_traffic_base": int(round(fitted["organic_traffic_base"])),
+            "average_order_value": max(int(round(fitted["average_order_value"])), 1),
+            **{f"season_{i}": round(min(max(v, 0.1), 5.0), 2) for i, v in enumerate(fitted["seasonality"])},
+        }
+        st.rerun()
 
 # Build data
-plan_configs = {
+plan_configs = custom_plans if is_custom_plans else {
     "🥈 シルバー": (silver_ad, silver_cvr, silver_trf),
     "🥇 ゴールド": (gold_ad, gold_cvr, gold_trf),
     "💎 プラチナ": (plat_ad, plat_cvr, plat_trf),
 }
+sim_plans = plan_configs if is_multi_plan else {"単一プラン": (1.0, 1.0, 1.0)}
+plans_list = list(sim_plans.keys())
+plan_colors = plan_color_map(plans_list)
 
-if is_multi_plan:
-    all_records = []
-    for pname, (a, c, t) in plan_configs.items():
-        all_records.extend(run_sim(pname, a, c, t))
-    df_all = pd.DataFrame(all_records)
-    plans_list = list(plan_configs.keys())
-else:
-    all_records = run_sim("単一プラン", 1.0, 1.0, 1.0)
-    df_all = pd.DataFrame(all_records)
-    plans_list = ["単一プラン"]
+# 同じパラメータの結果は全セッション・全ワーカーで共有（読み取り専用。df_all は変更しないこと）
+sim_result = result_cache.get_or_compute(
+    result_cache.cache_key(sim_params, sim_plans, {m: malls.MALLS[m] for m in active_malls}),
+    lambda: engine.simulate(sim_params, sim_plans))
+df_all = sim_result.to_pandas()   # プラン・月・モールは Categorical
 
 mall_colors = {k: v for k, v in ALL_MALL_COLORS.items() if k in active_malls}
 
+prof.lap("aggregation")
+
+# ══════════════════════════════════════════════
+# Helper: Detail table
+# ══════════════════════════════════════════════
+# 書式は Styler（全セルの HTML 生成）ではなく column_config でブラウザ側に任せる
+TABLE_FORMATS = {
+    "季節指数": "%.1f", "アクセス数": "localized", "CVR": "%.3f",
+    "売上 (円)": "yen", "原価 (円)": "yen", "モール手数料 (円)": "yen",
+    "広告費 (円)": "yen", "限界利益 (円)": "yen",
+}
+TABLE_PAGE_SIZE = 500
+
+def detail_table(df, rows, cols, key):
+    """df の rows 行目（行番号の配列）を 1 ページ分だけ取り出して表示する
+
+    送信するのは表示中のページだけなので、結果が何行あっても描画コストは一定。
+    """
+    n_pages = max(-(-len(rows) // TABLE_PAGE_SIZE), 1)
+    page = 1
+    if n_pages > 1:
+        page = st.number_input(f"ページ (全 {n_pages:,})", 1, n_pages, 1, key=key)
+    start = (page - 1) * TABLE_PAGE_SIZE
+    shown = rows[start:start + TABLE_PAGE_SIZE]
+    view = df.iloc[shown, df.columns.get_indexer(cols)]
+    dataframe(view, hide_index=True, use_container_width=True, height=460,
+              column_config={c: st.column_config.NumberColumn(format=f)
+                             for c, f in TABLE_FORMATS.items() if c in cols})
+    st.caption(f"{len(rows):,} 行中 {start + 1 if len(shown) else 0:,}–{start + len(shown):,} 行目")
+
+
 # ══════════════════════════════════════════════
-# Helper: Plan summary stats
+# Helper: Plan heatmap
 # ══════════════════════════════════════════════
-def plan_stats(df, plan_name):
-    pdf = df[df["プラン"] == plan_name]
-    s = pdf["売上 (円)"].sum()
-    p = pdf["限界利益 (円)"].sum()
-    a = pdf["広告費 (円)"].sum()
-    r = s / a if a > 0 else 0
-    pr = p / s * 100 if s > 0 else 0
-    return {"sales": s, "profit": p, "ad": a, "roas": r, "profit_rate": pr}
+def plan_heatmap(values, title, diverging=False):
+    """プラン × 列のヒートマップ（プラン数が多いときの重ね描きの代わり）"""
+    fig = px.imshow(values, aspect="auto", text_auto=".3s",
+                    color_continuous_scale="RdBu" if diverging else "Blues",
+                    color_continuous_midpoint=0 if diverging else None)
+    fig.update_layout(paper_bgcolor="#fff", height=max(320, 24 * len(values) + 120),
+        font=dict(family="Noto Sans JP", size=11, color="#1e293b"),
+        coloraxis_colorbar=dict(title=title), xaxis_title="", yaxis_title="",
+        margin=dict(l=20,r=20,t=30,b=20))
+    return fig
 
 
 # ██████████████████████████████████████████████
 #  MULTI-PLAN MODE
 # ██████████████████████████████████████████████
 if is_multi_plan:
+    import recommend
+    n_plans = len(plans_list)
+    large_n = n_plans > LARGE_N_PLANS
+    base_i, ref_i = plans_list.index(base_plan), plans_list.index(ref_plan)
+    ref_short = ref_plan.split(" ", 1)[-1]
+    # プラン別の年間指標は結果の配列から 1 パスで作る（df_all をプランごとに絞り込まない）
+    rec_table = recommend.from_result(sim_result, baseline=base_i)
 
     # ── Plan Comparison Summary ──
-    st.markdown('<div class="section-header">📋 3プラン比較サマリー（年間）</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="section-header">📋 {n_plans}プラン比較サマリー（年間）</div>', unsafe_allow_html=True)
 
     with st.expander("ℹ️ プラン比較の見方", expanded=False):
-        st.markdown("""
-        | プラン | コンセプト | 特徴 |
-        |--------|-----------|------|
-        | **🥈 シルバー** | 現状維持 | 広告費を抑え、リスク最小。成長は緩やか |
-        | **🥇 ゴールド** | 成長投資 | バランス型。着実な売上拡大を狙う（★推奨基準） |
-        | **💎 プラチナ** | 攻めの投資 | 広告・施策をフル投入。急成長だが投資リスクあり |
-
-        ゴールドを基準に、シルバー・プラチナの増減率を表示しています。
-        """)
-
-    stats = {p: plan_stats(df_all, p) for p in plans_list}
-    gold_s = stats["🥇 ゴールド"]
-
-    pcols = st.columns(3)
-    for idx, (pname, css_cls) in enumerate([
-        ("🥈 シルバー", "plan-card-silver"),
-        ("🥇 ゴールド", "plan-card-gold"),
-        ("💎 プラチナ", "plan-card-platinum"),
-    ]):
-        s = stats[pname]
-        with pcols[idx]:
-            badge = '<span class="recommend-badge">★推奨</span>' if pname == "🥇 ゴールド" else ""
-            # Diff vs Gold
-            if pname != "🥇 ゴールド" and gold_s["sales"] > 0:
-                sd = (s["sales"] - gold_s["sales"]) / gold_s["sales"] * 100
-                pd_ = (s["profit"] - gold_s["profit"]) / gold_s["profit"] * 100 if gold_s["profit"] != 0 else 0
-                diff_cls_s = "plan-diff-up" if sd >= 0 else "plan-diff-down"
-                diff_cls_p = "plan-diff-up" if pd_ >= 0 else "plan-diff-down"
-                diff_html = (f'<p class="plan-label">対ゴールド</p>'
-                             f'<span class="plan-diff {diff_cls_s}">売上 {sd:+.0f}%</span> '
-                             f'<span class="plan-diff {diff_cls_p}">利益 {pd_:+.0f}%</span>')
-            else:
-                diff_html = '<p class="plan-label">── 基準プラン ──</p>'
-
+        if is_custom_plans:
             st.markdown(f"""
-            <div class="plan-card {css_cls}">
-                <h4>{pname}{badge}</h4>
-                <p class="plan-label">年間売上</p>
-                <p class="plan-value">¥{s["sales"]:,.0f}</p>
-                <p class="plan-label">年間限界利益</p>
-                <p class="plan-value">¥{s["profit"]:,.0f}</p>
-                <p class="plan-label">年間広告費</p>
-                <p class="plan-value">¥{s["ad"]:,.0f}</p>
-                <p class="plan-label">ROAS: {s["roas"]:.2f}倍 ／ 利益率: {s["profit_rate"]:.1f}%</p>
-                {diff_html}
-            </div>
-            """, unsafe_allow_html=True)
+            - 増減率は **基準プラン（{ref_plan}）**、投資対効果は **比較元プラン（{base_plan}）** との差です（サイドバーで変更できます）。
+            - {LARGE_N_PLANS}プランを超えると、カードの代わりに表、チャートはヒートマップ・プラン別の小分けグラフで表示します。
+            """)
+        else:
+            st.markdown("""
+            | プラン | コンセプト | 特徴 |
+            |--------|-----------|------|
+            | **🥈 シルバー** | 現状維持 | 広告費を抑え、リスク最小。成長は緩やか |
+            | **🥇 ゴールド** | 成長投資 | バランス型。着実な売上拡大を狙う（★推奨基準） |
+            | **💎 プラチナ** | 攻めの投資 | 広告・施策をフル投入。急成長だが投資リスクあり |
+
+            ゴールドを基準に、シルバー・プラチナの増減率を表示しています。
+            """)
+
+    ref_sales, ref_profit = rec_table["sales"][ref_i], rec_table["profit"][ref_i]
+    if large_n:
+        summary = pd.DataFrame({
+            "プラン": plans_list, "年間売上 (円)": rec_table["sales"], "年間限界利益 (円)": rec_table["profit"],
+            "年間広告費 (円)": rec_table["ad"], "ROAS": rec_table["roas"], "利益率 (%)": rec_table["profit_rate"],
+            f"売上 対{ref_short} (%)": (rec_table["sales"] / ref_sales - 1) * 100 if ref_sales > 0 else 0.0,
+            f"利益 対{ref_short} (%)": (rec_table["profit"] / ref_profit - 1) * 100 if ref_profit != 0 else 0.0,
+        })
+        dataframe(summary, hide_index=True, use_container_width=True, height=min(36 + 35 * n_plans, 600),
+                  column_config={**{c: st.column_config.NumberColumn(format="yen") for c in summary.columns[1:4]},
+                                 "ROAS": st.column_config.NumberColumn(format="%.2f倍"),
+                                 **{c: st.column_config.NumberColumn(format="%+.1f") for c in summary.columns[5:]}})
+    else:
+        for row_start in range(0, n_plans, 3):
+            pcols = st.columns(3)
+            for idx in range(row_start, min(row_start + 3, n_plans)):
+                pname = plans_list[idx]
+                css_cls = PLAN_CARD_CLASS.get(pname, "plan-card-gold" if idx == ref_i else "plan-card-silver")
+                with pcols[idx - row_start]:
+                    badge = '<span class="recommend-badge">★推奨</span>' if idx == ref_i else ""
+                    # Diff vs reference plan
+                    if idx != ref_i and ref_sales > 0:
+                        sd = (rec_table["sales"][idx] - ref_sales) / ref_sales * 100
+                        pd_ = (rec_table["profit"][idx] - ref_profit) / ref_profit * 100 if ref_profit != 0 else 0
+                        diff_cls_s = "plan-diff-up" if sd >= 0 else "plan-diff-down"
+                        diff_cls_p = "plan-diff-up" if pd_ >= 0 else "plan-diff-down"
+                        diff_html = (f'<p class="plan-label">対{ref_short}</p>'
+                                     f'<span class="plan-diff {diff_cls_s}">売上 {sd:+.0f}%</span> '
+                                     f'<span class="plan-diff {diff_cls_p}">利益 {pd_:+.0f}%</span>')
+                    else:
+                        diff_html = '<p class="plan-label">── 基準プラン ──</p>'
+
+                    st.markdown(f"""
+                    <div class="plan-card {css_cls}">
+                        <h4>{pname}{badge}</h4>
+                        <p class="plan-label">年間売上</p>
+                        <p class="plan-value">¥{rec_table["sales"][idx]:,.0f}</p>
+                        <p class="plan-label">年間限界利益</p>
+                        <p class="plan-value">¥{rec_table["profit"][idx]:,.0f}</p>
+                        <p class="plan-label">年間広告費</p>
+                        <p class="plan-value">¥{rec_table["ad"][idx]:,.0f}</p>
+                        <p class="plan-label">ROAS: {rec_table["roas"][idx]:.2f}倍 ／ 利益率: {rec_table["profit_rate"][idx]:.1f}%</p>
+                        {diff_html}
+                    </div>
+                    """, unsafe_allow_html=True)
 
     # ── Investment ROI Summary ──
     st.markdown('<div class="section-header">💡 投資対効果分析</div>', unsafe_allow_html=True)
 
-    silver_s = stats["🥈 シルバー"]
-    roi_cols = st.columns(2)
-    for idx, pname in enumerate(["🥇 ゴールド", "💎 プラチナ"]):
-        s = stats[pname]
-        inc_ad = s["ad"] - silver_s["ad"]
-        inc_sales = s["sales"] - silver_s["sales"]
-        inc_profit = s["profit"] - silver_s["profit"]
-        inc_roas = inc_sales / inc_ad if inc_ad > 0 else 0
-        inc_roi = inc_profit / inc_ad if inc_ad > 0 else 0
-        with roi_cols[idx]:
-            st.markdown(f"**{pname}（対シルバー）**")
-            c1, c2 = st.columns(2)
-            c1.metric("追加投資額/年", f"¥{inc_ad:,.0f}")
-            c2.metric("追加売上/年", f"¥{inc_sales:,.0f}")
-            c3, c4 = st.columns(2)
-            c3.metric("追加利益/年", f"¥{inc_profit:,.0f}")
-            c4.metric("追加投資ROAS", f"{inc_roas:.2f}倍")
-
+    others = [i for i in range(n_plans) if i != base_i]
+    base_short = base_plan.split(" ", 1)[-1]
+    if large_n:
+        roi = pd.DataFrame({"プラン": [plans_list[i] for i in others],
+                            **{label: rec_table[k][others] for k, label in (
+                                ("inc_ad", "追加投資額/年"), ("inc_sales", "追加売上/年"), ("inc_profit", "追加利益/年"),
+                                ("inc_roas", "追加投資ROAS"), ("inc_roi", "回収倍率"))}})
+        st.caption(f"比較元: {base_plan}")
+        dataframe(roi, hide_index=True, use_container_width=True, height=min(36 + 35 * len(others), 600),
+                  column_config={**{c: st.column_config.NumberColumn(format="yen") for c in roi.columns[1:4]},
+                                 **{c: st.column_config.NumberColumn(format="%.2f倍") for c in roi.columns[4:]}})
+    else:
+        for row_start in range(0, len(others), 2):
+            roi_cols = st.columns(2)
+            for col, idx in zip(roi_cols, others[row_start:row_start + 2]):
+                with col:
+                    st.markdown(f"**{plans_list[idx]}（対{base_short}）**")
+                    c1, c2 = st.columns(2)
+                    c1.metric("追加投資額/年", f"¥{rec_table['inc_ad'][idx]:,.0f}")
+                    c2.metric("追加売上/年", f"¥{rec_table['inc_sales'][idx]:,.0f}")
+                    c3, c4 = st.columns(2)
+                    c3.metric("追加利益/年", f"¥{rec_table['inc_profit'][idx]:,.0f}")
+                    c4.metric("追加投資ROAS", f"{rec_table['inc_roas'][idx]:.2f}倍")
+
+    prof.lap("recommendation")
     # ── Recommend & Consultant Comment ──
-    def recommend():
-        recs = []
-        for pname in ["💎 プラチナ", "🥇 ゴールド"]:
-            s = stats[pname]
-            inc_ad = s["ad"] - silver_s["ad"]
-            inc_roas = (s["sales"] - silver_s["sales"]) / inc_ad if inc_ad > 0 else 0
-            if s["profit"] > 0 and inc_roas >= 3.0 and s["profit_rate"] >= 15:
-                recs.append(pname)
-        return recs if recs else ["🥈 シルバー"]
-
-    recs = recommend()
-    top_rec = recs[0]
-
-    # Build comment
-    top_s = stats[top_rec]
-    inc_ad = top_s["ad"] - silver_s["ad"]
-    inc_sales = top_s["sales"] - silver_s["sales"]
-    inc_profit = top_s["profit"] - silver_s["profit"]
-    inc_pct = inc_sales / silver_s["sales"] * 100 if silver_s["sales"] > 0 else 0
-    inc_roi = inc_profit / inc_ad if inc_ad > 0 else 0
-
-    comment_lines = [f"本シミュレーションの結果、<b>{top_rec}</b> を推奨します。"]
-    if top_rec != "🥈 シルバー":
-        comment_lines.append(f"シルバー比で年間売上 <b>+¥{inc_sales:,.0f}</b>（<b>+{inc_pct:.0f}%</b>）が見込めます。")
-        comment_lines.append(f"追加投資 ¥{inc_ad:,.0f} に対し、追加利益 ¥{inc_profit:,.0f}（<b>{inc_roi:.1f}倍回収</b>）。")
-    # Check for risk in platinum
-    plat_s = stats["💎 プラチナ"]
-    if plat_s["profit_rate"] < gold_s["profit_rate"] and top_rec != "💎 プラチナ":
-        comment_lines.append(f"プラチナプランは利益率が {plat_s['profit_rate']:.1f}% に低下するためリスクがあります。")
-
-    # Best mall
-    mall_profit = df_all[df_all["プラン"] == top_rec].groupby("モール")["限界利益 (円)"].sum()
-    if len(mall_profit) > 0:
-        best_mall = mall_profit.idxmax()
-        comment_lines.append(f"モール別では <b>{best_mall}</b> の利益貢献が最も高い結果となりました。")
+    # 比較元・利益率の基準はサイドバーで選んだプラン（推奨ルールで判定）
+    recs = recommend.recommend(rec_table, rec_rules, rank_by, baseline=base_i)
+    comment_lines = recommend.comment(rec_table, plans_list, recs[0], baseline=base_i,
+                                      reference=ref_i, malls=active_malls)
 
     st.markdown(
         '<div class="consul-box"><h4>💡 コンサルタントの所見（自動生成）</h4>'
         + "".join(f"<p>・{l}</p>" for l in comment_lines)
         + '</div>', unsafe_allow_html=True)
 
+    prof.lap("charts:monthly")
     # ── Monthly Sales Comparison Charts ──
     st.markdown('<div class="section-header">📈 プラン別 月次売上推移</div>', unsafe_allow_html=True)
 
     with st.expander("ℹ️ チャートの読み方", expanded=False):
-        st.markdown("""
-        - **全モール合計**: 3プランの売上推移を折れ線で比較
-        - **モール別内訳**: プラン×モール別の棒グラフ
-        - **限界利益推移**: プラン別の月次利益を比較
-        - **累積利益**: 12ヶ月間の利益の積み上がりの差を可視化
-        """)
+        if large_n:
+            st.markdown("""
+            - **全モール合計**: プランごとの小分けグラフで売上推移を比較
+            - **モール別内訳 / 限界利益推移 / 累積利益**: プラン（行）× モール・月（列）のヒートマップ
+            """)
+        else:
+            st.markdown(f"""
+            - **全モール合計**: {n_plans}プランの売上推移を折れ線で比較
+            - **モール別内訳**: プラン×モール別の棒グラフ
+            - **限界利益推移**: プラン別の月次利益を比較
+            - **累積利益**: 12ヶ月間の利益の積み上がりの差を可視化
+            """)
 
     t1, t2, t3, t4 = st.tabs(["📉 全モール合計", "📊 モール別内訳", "💰 限界利益推移", "📈 累積利益"])
 
-    # Aggregate by plan+month
-    monthly_plan = df_all.groupby(["プラン","月","月番号"]).agg(
+    # Aggregate by plan+month（集計は 1 回。累積利益もここで計算する）
+    monthly_plan = df_all.groupby(["プラン","月","月番号"], observed=True).agg(
         {"売上 (円)":"sum", "限界利益 (円)":"sum", "広告費 (円)":"sum"}).reset_index().sort_values("月番号")
+    monthly_plan["累積利益 (円)"] = monthly_plan.groupby("プラン", observed=True)["限界利益 (円)"].cumsum()
+    chart_orders = {"月": month_labels, "プラン": plans_list}
+    facet_rows = -(-n_plans // 5)
 
     with t1:
-        fig = px.line(monthly_plan, x="月", y="売上 (円)", color="プラン", markers=True,
-            color_discrete_map=PLAN_COLORS, category_orders={"月": month_labels, "プラン": plans_list})
-        fig.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=420,
-            font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
-            legend=dict(orientation="h", y=1.08, x=0.5, xanchor="center", font=dict(color="#1e293b")),
-            yaxis_title="売上 (円)", xaxis_title="",
-            margin=dict(l=20,r=20,t=40,b=20),
-            xaxis=dict(tickfont=dict(color="#1e293b")), yaxis=dict(tickfont=dict(color="#1e293b")))
-        # Make gold line thicker
-        for trace in fig.data:
-            if "ゴールド" in trace.name:
-                trace.line.width = 4
-            elif "シルバー" in trace.name:
-                trace.line.dash = "dash"
-        st.plotly_chart(fig, use_container_width=True)
+        if large_n:
+            fig = px.line(monthly_plan, x="月", y="売上 (円)", color="プラン", facet_col="プラン",
+                facet_col_wrap=5, color_discrete_map=plan_colors, category_orders=chart_orders)
+            fig.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=170 * facet_rows + 60,
+                font=dict(family="Noto Sans JP", size=10, color="#1e293b"), showlegend=False,
+                margin=dict(l=20,r=20,t=40,b=20))
+            fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1], font=dict(color="#1e293b")))
+            fig.update_xaxes(title="", showticklabels=False)
+            fig.update_yaxes(title="", tickformat=".2s")
+        else:
+            fig = px.line(monthly_plan, x="月", y="売上 (円)", color="プラン", markers=True,
+                color_discrete_map=plan_colors, category_orders=chart_orders)
+            fig.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=420,
+                font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
+                legend=dict(orientation="h", y=1.08, x=0.5, xanchor="center", font=dict(color="#1e293b")),
+                yaxis_title="売上 (円)", xaxis_title="",
+                margin=dict(l=20,r=20,t=40,b=20),
+                xaxis=dict(tickfont=dict(color="#1e293b")), yaxis=dict(tickfont=dict(color="#1e293b")))
+            # Make reference line thicker, baseline dashed
+            for trace in fig.data:
+                if trace.name == ref_plan:
+                    trace.line.width = 4
+                elif trace.name == base_plan:
+                    trace.line.dash = "dash"
+        plotly_chart(fig, use_container_width=True)
+
+    prof.lap("aggregation:pivot_table")
+    matrix_sales = df_all.pivot_table(index="プラン", columns="モール", values="売上 (円)", aggfunc="sum", observed=True)
+    matrix_profit = df_all.pivot_table(index="プラン", columns="モール", values="限界利益 (円)", aggfunc="sum", observed=True)
 
     with t2:
-        fig2 = px.bar(df_all, x="月", y="売上 (円)", color="プラン", barmode="group",
-            facet_col="モール", text_auto=".3s",
-            color_discrete_map=PLAN_COLORS,
-            category_orders={"月": month_labels, "プラン": plans_list})
-        fig2.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=450,
-            font=dict(family="Noto Sans JP", size=11, color="#1e293b"),
-            legend=dict(orientation="h", y=1.12, x=0.5, xanchor="center", font=dict(color="#1e293b")),
-            margin=dict(l=20,r=20,t=60,b=20))
-        fig2.update_traces(textposition="outside", textfont_size=8)
-        fig2.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1], font=dict(color="#1e293b")))
-        st.plotly_chart(fig2, use_container_width=True)
+        if large_n:
+            fig2 = plan_heatmap(matrix_sales, "売上 (円)")
+        else:
+            fig2 = px.bar(df_all, x="月", y="売上 (円)", color="プラン", barmode="group",
+                facet_col="モール", text_auto=".3s",
+                color_discrete_map=plan_colors,
+                category_orders=chart_orders)
+            fig2.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=450,
+                font=dict(family="Noto Sans JP", size=11, color="#1e293b"),
+                legend=dict(orientation="h", y=1.12, x=0.5, xanchor="center", font=dict(color="#1e293b")),
+                margin=dict(l=20,r=20,t=60,b=20))
+            fig2.update_traces(textposition="outside", textfont_size=8)
+            fig2.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1], font=dict(color="#1e293b")))
+        plotly_chart(fig2, use_container_width=True)
 
     with t3:
-        fig3 = px.bar(monthly_plan, x="月", y="限界利益 (円)", color="プラン", barmode="group",
-            text_auto=".3s", color_discrete_map=PLAN_COLORS,
-            category_orders={"月": month_labels, "プラン": plans_list})
-        fig3.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=420,
-            font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
-            legend=dict(orientation="h", y=1.08, x=0.5, xanchor="center", font=dict(color="#1e293b")),
-            yaxis_title="限界利益 (円)", xaxis_title="",
-            margin=dict(l=20,r=20,t=40,b=20),
-            xaxis=dict(tickfont=dict(color="#1e293b")), yaxis=dict(tickfont=dict(color="#1e293b")))
-        st.plotly_chart(fig3, use_container_width=True)
+        if large_n:
+            fig3 = plan_heatmap(monthly_plan.pivot_table(index="プラン", columns="月", values="限界利益 (円)",
+                                                         aggfunc="sum", observed=True), "限界利益 (円)", diverging=True)
+        else:
+            fig3 = px.bar(monthly_plan, x="月", y="限界利益 (円)", color="プラン", barmode="group",
+                text_auto=".3s", color_discrete_map=plan_colors,
+                category_orders=chart_orders)
+            fig3.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=420,
+                font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
+                legend=dict(orientation="h", y=1.08, x=0.5, xanchor="center", font=dict(color="#1e293b")),
+                yaxis_title="限界利益 (円)", xaxis_title="",
+                margin=dict(l=20,r=20,t=40,b=20),
+                xaxis=dict(tickfont=dict(color="#1e293b")), yaxis=dict(tickfont=dict(color="#1e293b")))
+        plotly_chart(fig3, use_container_width=True)
 
     with t4:
         # Cumulative profit
-        cum_data = []
-        for pname in plans_list:
-            pdf = monthly_plan[monthly_plan["プラン"] == pname].sort_values("月番号")
-            cum = pdf["限界利益 (円)"].cumsum().tolist()
-            for i, row in enumerate(pdf.itertuples()):
-                cum_data.append({"プラン": pname, "月": row.月, "月番号": row.月番号, "累積利益 (円)": cum[i]})
-        cum_df = pd.DataFrame(cum_data)
-
-        fig4 = px.area(cum_df, x="月", y="累積利益 (円)", color="プラン",
-            color_discrete_map=PLAN_COLORS, category_orders={"月": month_labels, "プラン": plans_list})
-        fig4.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=420,
-            font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
-            legend=dict(orientation="h", y=1.08, x=0.5, xanchor="center", font=dict(color="#1e293b")),
-            yaxis_title="累積限界利益 (円)", xaxis_title="",
-            margin=dict(l=20,r=20,t=40,b=20),
-            xaxis=dict(tickfont=dict(color="#1e293b")), yaxis=dict(tickfont=dict(color="#1e293b")))
-        # Add end-point annotations
-        for pname in plans_list:
-            last = cum_df[cum_df["プラン"]==pname].iloc[-1]
-            fig4.add_annotation(x=last["月"], y=last["累積利益 (円)"],
-                text=f"¥{last['累積利益 (円)']:,.0f}", showarrow=True, arrowhead=2,
-                font=dict(size=11, color=PLAN_COLORS[pname], family="Noto Sans JP"),
-                bordercolor=PLAN_COLORS[pname], borderwidth=1, borderpad=3, bgcolor="#fff")
-        st.plotly_chart(fig4, use_container_width=True)
+        if large_n:
+            fig4 = plan_heatmap(monthly_plan.pivot_table(index="プラン", columns="月", values="累積利益 (円)",
+                                                         aggfunc="sum", observed=True), "累積利益 (円)", diverging=True)
+        else:
+            fig4 = px.area(monthly_plan, x="月", y="累積利益 (円)", color="プラン",
+                color_discrete_map=plan_colors, category_orders=chart_orders)
+            fig4.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=420,
+                font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
+                legend=dict(orientation="h", y=1.08, x=0.5, xanchor="center", font=dict(color="#1e293b")),
+                yaxis_title="累積限界利益 (円)", xaxis_title="",
+                margin=dict(l=20,r=20,t=40,b=20),
+                xaxis=dict(tickfont=dict(color="#1e293b")), yaxis=dict(tickfont=dict(color="#1e293b")))
+            # Add end-point annotations
+            for last in monthly_plan[monthly_plan["月番号"] == 12].itertuples(index=False):
+                pname, value = last[0], last[-1]
+                fig4.add_annotation(x=last[1], y=value,
+                    text=f"¥{value:,.0f}", showarrow=True, arrowhead=2,
+                    font=dict(size=11, color=plan_colors[pname], family="Noto Sans JP"),
+                    bordercolor=plan_colors[pname], borderwidth=1, borderpad=3, bgcolor="#fff")
+        plotly_chart(fig4, use_container_width=True)
 
     # ── Plan × Mall Matrix ──
     st.markdown('<div class="section-header">🧩 プラン×モール マトリクス（年間）</div>', unsafe_allow_html=True)
 
-    matrix_sales = df_all.pivot_table(index="プラン", columns="モール", values="売上 (円)", aggfunc="sum")
-    matrix_profit = df_all.pivot_table(index="プラン", columns="モール", values="限界利益 (円)", aggfunc="sum")
     matrix_sales["合計"] = matrix_sales.sum(axis=1)
     matrix_profit["合計"] = matrix_profit.sum(axis=1)
 
@@ -621,37 +837,39 @@ if is_multi_plan:
 
     mt1, mt2 = st.tabs(["💰 売上", "📊 限界利益"])
     with mt1:
-        st.dataframe(matrix_sales.style.format("¥{:,.0f}"), use_container_width=True)
+        dataframe(matrix_sales.style.format("¥{:,.0f}"), use_container_width=True)
     with mt2:
-        st.dataframe(matrix_profit.style.format("¥{:,.0f}"), use_container_width=True)
+        dataframe(matrix_profit.style.format("¥{:,.0f}"), use_container_width=True)
 
+    prof.lap("charts:cost")
     # ── Cost Composition ──
-    st.markdown('<div class="section-header">🧩 コスト構成分析（ゴールド基準）</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="section-header">🧩 コスト構成分析（{ref_short}基準）</div>', unsafe_allow_html=True)
 
-    gold_df = df_all[df_all["プラン"] == "🥇 ゴールド"]
+    ref_df = df_all.iloc[engine.row_positions(plans_list, active_malls, plan=ref_plan)]
     cc1, cc2 = st.columns(2)
     with cc1:
         cd = {"項目": ["原価","モール手数料","広告費","限界利益"],
-              "金額": [gold_df["原価 (円)"].sum(), gold_df["モール手数料 (円)"].sum(),
-                       gold_df["広告費 (円)"].sum(), max(gold_df["限界利益 (円)"].sum(), 0)]}
+              "金額": [ref_df["原価 (円)"].sum(), ref_df["モール手数料 (円)"].sum(),
+                       ref_df["広告費 (円)"].sum(), max(ref_df["限界利益 (円)"].sum(), 0)]}
         fp = px.pie(pd.DataFrame(cd), values="金額", names="項目", hole=0.45,
             color_discrete_map={"原価":"#64748b","モール手数料":"#f59e0b","広告費":"#3b82f6","限界利益":"#10b981"})
         fp.update_layout(font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
             margin=dict(l=10,r=10,t=30,b=10), height=350,
-            title=dict(text="ゴールド コスト構成", font_size=14, font_color="#1e293b"),
+            title=dict(text=f"{ref_short} コスト構成", font_size=14, font_color="#1e293b"),
             legend=dict(font=dict(color="#1e293b")))
         fp.update_traces(textinfo="label+percent", textfont_size=11)
-        st.plotly_chart(fp, use_container_width=True)
+        plotly_chart(fp, use_container_width=True)
     with cc2:
-        sd = gold_df.groupby("モール")["売上 (円)"].sum().reset_index()
+        sd = ref_df.groupby("モール", observed=True)["売上 (円)"].sum().reset_index()
         fs = px.pie(sd, values="売上 (円)", names="モール", hole=0.45, color_discrete_map=mall_colors)
         fs.update_layout(font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
             margin=dict(l=10,r=10,t=30,b=10), height=350,
-            title=dict(text="ゴールド モール構成比", font_size=14, font_color="#1e293b"),
+            title=dict(text=f"{ref_short} モール構成比", font_size=14, font_color="#1e293b"),
             legend=dict(font=dict(color="#1e293b")))
         fs.update_traces(textinfo="label+percent", textfont_size=11)
-        st.plotly_chart(fs, use_container_width=True)
+        plotly_chart(fs, use_container_width=True)
 
+    prof.lap("detail_table")
     # ── Detail Table ──
     st.markdown('<div class="section-header">📋 詳細データテーブル</div>', unsafe_allow_html=True)
 
@@ -661,18 +879,16 @@ if is_multi_plan:
     with ft2:
         sel_mall = st.selectbox("モール選択", ["全モール"] + active_malls, key="tbl_mall")
 
-    tbl = df_all.copy()
-    if sel_plan != "全プラン": tbl = tbl[tbl["プラン"] == sel_plan]
-    if sel_mall != "全モール": tbl = tbl[tbl["モール"] == sel_mall]
-
+    rows = engine.row_positions(plans_list, active_malls,
+                                plan=None if sel_plan == "全プラン" else sel_plan,
+                                mall=None if sel_mall == "全モール" else sel_mall)
     dcols = ["プラン","月","モール","アクセス数","CVR","売上 (円)","原価 (円)","モール手数料 (円)","広告費 (円)","限界利益 (円)"]
-    st.dataframe(tbl[dcols].style.format({
-        "アクセス数":"{:,.0f}","CVR":"{:.3f}","売上 (円)":"¥{:,.0f}","原価 (円)":"¥{:,.0f}",
-        "モール手数料 (円)":"¥{:,.0f}","広告費 (円)":"¥{:,.0f}","限界利益 (円)":"¥{:,.0f}"}),
-        use_container_width=True, height=460)
+    detail_table(df_all, rows, dcols, key=f"tbl_page_{sel_plan}_{sel_mall}")
 
-    csv = df_all[dcols].to_csv(index=False).encode("utf-8-sig")
-    st.download_button("📥 全プランCSVダウンロード", csv, "ec_3plan_simulation.csv", "text/csv")
+    # CSV はダウンロード時にだけ生成する
+    st.download_button("📥 全プランCSVダウンロード",
+                       lambda: df_all[dcols].to_csv(index=False).encode("utf-8-sig"),
+                       f"ec_{n_plans}plan_simulation.csv", "text/csv")
 
 
 # ██████████████████████████████████████████████
@@ -714,6 +930,7 @@ else:
     if profit_rate > 40:
         st.success(f"✅ 利益率 {profit_rate:.1f}% と良好。広告拡大の余地があります。")
 
+    prof.lap("aggregation:mall_summary")
     # ── Mall Summary ──
     st.markdown('<div class="section-header">🏬 モール別 年間サマリー</div>', unsafe_allow_html=True)
     mcols = st.columns(len(mall_colors))
@@ -728,6 +945,7 @@ else:
             st.metric("年間利益", f"¥{mp:,.0f}")
             st.metric("ROAS / 構成比", f"{mr:.2f}倍 / {share:.1f}%")
 
+    prof.lap("charts:monthly")
     # ── Charts ──
     st.markdown('<div class="section-header">📈 月別売上推移</div>', unsafe_allow_html=True)
     ct1,ct2,ct3 = st.tabs(["📊 積上げ棒","📉 折れ線","💰 限界利益"])
@@ -740,7 +958,7 @@ else:
             yaxis_title="売上 (円)",xaxis_title="",margin=dict(l=20,r=20,t=40,b=20),
             xaxis=dict(tickfont=dict(color="#1e293b")),yaxis=dict(tickfont=dict(color="#1e293b")))
         f1.update_traces(textposition="inside",textfont_size=10)
-        st.plotly_chart(f1, use_container_width=True)
+        plotly_chart(f1, use_container_width=True)
     with ct2:
         f2 = px.line(df, x="月", y="売上 (円)", color="モール", markers=True,
             color_discrete_map=mall_colors, category_orders={"月":month_labels})
@@ -749,7 +967,7 @@ else:
             legend=dict(orientation="h",y=1.02,x=0.5,xanchor="center",font=dict(color="#1e293b")),
             yaxis_title="売上 (円)",xaxis_title="",margin=dict(l=20,r=20,t=40,b=20),
             xaxis=dict(tickfont=dict(color="#1e293b")),yaxis=dict(tickfont=dict(color="#1e293b")))
-        st.plotly_chart(f2, use_container_width=True)
+        plotly_chart(f2, use_container_width=True)
     with ct3:
         f3 = px.bar(df, x="月", y="限界利益 (円)", color="モール", barmode="group", text_auto=".3s",
             color_discrete_map=mall_colors, category_orders={"月":month_labels})
@@ -758,8 +976,9 @@ else:
             legend=dict(orientation="h",y=1.02,x=0.5,xanchor="center",font=dict(color="#1e293b")),
             yaxis_title="限界利益 (円)",xaxis_title="",margin=dict(l=20,r=20,t=40,b=20),
             xaxis=dict(tickfont=dict(color="#1e293b")),yaxis=dict(tickfont=dict(color="#1e293b")))
-        st.plotly_chart(f3, use_container_width=True)
+        plotly_chart(f3, use_container_width=True)
 
+    prof.lap("charts:cost")
     # ── Cost Composition ──
     st.markdown('<div class="section-header">🧩 コスト構成分析</div>', unsafe_allow_html=True)
     cc1, cc2 = st.columns(2)
@@ -773,28 +992,204 @@ else:
             title=dict(text="年間コスト構成",font_size=14,font_color="#1e293b"),
             legend=dict(font=dict(color="#1e293b")))
         fp.update_traces(textinfo="label+percent",textfont_size=11)
-        st.plotly_chart(fp, use_container_width=True)
+        plotly_chart(fp, use_container_width=True)
     with cc2:
-        sd = df.groupby("モール")["売上 (円)"].sum().reset_index()
+        sd = df.groupby("モール", observed=True)["売上 (円)"].sum().reset_index()
         fs = px.pie(sd,values="売上 (円)",names="モール",hole=0.45,color_discrete_map=mall_colors)
         fs.update_layout(font=dict(family="Noto Sans JP",size=12,color="#1e293b"),
             margin=dict(l=10,r=10,t=30,b=10),height=350,
             title=dict(text="モール別売上構成比",font_size=14,font_color="#1e293b"),
             legend=dict(font=dict(color="#1e293b")))
         fs.update_traces(textinfo="label+percent",textfont_size=11)
-        st.plotly_chart(fs, use_container_width=True)
+        plotly_chart(fs, use_container_width=True)
 
+    prof.lap("detail_table")
     # ── Table ──
     st.markdown('<div class="section-header">📋 月別詳細データ</div>', unsafe_allow_html=True)
     sel_mall = st.selectbox("モール選択", ["全モール"] + active_malls, key="single_mall")
-    tbl = df.copy()
-    if sel_mall != "全モール": tbl = tbl[tbl["モール"] == sel_mall]
+    rows = engine.row_positions(plans_list, active_malls, mall=None if sel_mall == "全モール" else sel_mall)
     dcols = ["月","モール","季節指数","アクセス数","CVR","売上 (円)","原価 (円)","モール手数料 (円)","広告費 (円)","限界利益 (円)"]
-    st.dataframe(tbl[dcols].style.format({"季節指数":"{:.1f}","アクセス数":"{:,.0f}","CVR":"{:.3f}",
-        "売上 (円)":"¥{:,.0f}","原価 (円)":"¥{:,.0f}","モール手数料 (円)":"¥{:,.0f}",
-        "広告費 (円)":"¥{:,.0f}","限界利益 (円)":"¥{:,.0f}"}), use_container_width=True, height=460)
-    csv = df[dcols].to_csv(index=False).encode("utf-8-sig")
-    st.download_button("📥 CSVダウンロード", csv, "ec_simulation_result.csv", "text/csv")
+    detail_table(df, rows, dcols, key=f"single_page_{sel_mall}")
+    st.download_button("📥 CSVダウンロード", lambda: df[dcols].to_csv(index=False).encode("utf-8-sig"),
+                       "ec_simulation_result.csv", "text/csv")
+
+prof.lap("calibration_view")
+
+# ══════════════════════════════════════════════
+# Calibration report (both modes, after fitting actuals)
+# ══════════════════════════════════════════════
+calib = st.session_state.get("calibration")
+if calib:
+    st.markdown('<div class="section-header">📐 実績データへの適合度</div>', unsafe_allow_html=True)
+    fitted = calib["params"]
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("決定係数 R²（売上）", f"{calib['r2']:.3f}")
+    c2.metric("MAPE（売上）", f"{calib['mape']:.1f}%")
+    c3.metric("推定 基礎転換率", f"{fitted['base_cvr']:.3f}" + ("（固定）" if "base_cvr" in calib["fixed"] else ""))
+    c4.metric("推定 CPC / 自然流入", f"¥{fitted['target_cpc']:,.0f} / {fitted['organic_traffic_base']:,.0f}")
+    if calib["fixed"]:
+        st.caption("※ 実績にアクセス数がないため、基礎転換率は推定前のサイドバーの値に固定しています。")
+    rc1, rc2 = st.columns([1, 2])
+    with rc1:
+        dataframe(calib["report"], hide_index=True, use_container_width=True,
+                  column_config={"R²": st.column_config.NumberColumn(format="%.3f"),
+                                 "MAPE (%)": st.column_config.NumberColumn(format="%.1f")})
+        st.caption(f"推定値はサイドバーに反映済み（反復 {calib['iterations']} 回）。")
+    with rc2:
+        fit_df = calib["fitted"].assign(年月=lambda d: d["年月"].dt.to_timestamp())
+        fit_long = fit_df.melt(id_vars=["モール", "年月"], value_vars=["実績売上 (円)", "推定売上 (円)"],
+                               var_name="系列", value_name="売上 (円)")
+        ff = px.line(fit_long, x="年月", y="売上 (円)", color="モール", line_dash="系列",
+                     color_discrete_map=ALL_MALL_COLORS)
+        ff.update_layout(font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
+            margin=dict(l=10,r=10,t=30,b=10), height=320, yaxis_tickformat=",",
+            legend=dict(font=dict(color="#1e293b")))
+        plotly_chart(ff, use_container_width=True)
+
+prof.lap("cohort_view")
+
+# ══════════════════════════════════════════════
+# Repeat purchase & LTV / CAC (both modes, optional)
+# ══════════════════════════════════════════════
+if cohort_settings:
+    st.markdown('<div class="section-header">👥 リピート購入・LTV / CAC</div>', unsafe_allow_html=True)
+    with st.expander("ℹ️ この分析の見方", expanded=False):
+        st.markdown(f"""
+        - **新規顧客数**: 広告・自然流入からの注文（＝初回購入）の合計
+        - **リピート売上**: 獲得月ごとの顧客コホートがリテンションカーブに沿って再購入した売上（年間売上・限界利益に含まれます）
+        - **CAC**: 広告費 ÷ 新規顧客数 ／ **LTV**: 顧客1人あたりの{cohort_settings['ltv_months']}ヶ月間の粗利（原価・手数料控除後）
+        - **LTV/CAC**: 3倍以上が健全な目安
+        """)
+
+    # プラン別の合計は結果の配列から 1 パスで作る
+    ltv_df = pd.DataFrame(sim_result.plan_totals(["新規注文数", "リピート注文数", "リピート売上 (円)", "広告費 (円)"]),
+                          index=pd.Index(plans_list, name="プラン")).rename(columns={"新規注文数": "新規顧客数"})
+    ltv_sum = (df_all["顧客LTV (円)"] * df_all["新規注文数"]).groupby(df_all["プラン"], observed=True).sum()
+    new_c = ltv_df["新規顧客数"]
+    ltv_df["CAC (円)"] = (ltv_df.pop("広告費 (円)") / new_c).where(new_c > 0, 0)
+    ltv_df["LTV (円)"] = (ltv_sum.to_numpy() / new_c).where(new_c > 0, 0)
+    ltv_df["LTV/CAC"] = (ltv_df["LTV (円)"] / ltv_df["CAC (円)"]).where(ltv_df["CAC (円)"] > 0, 0)
+    dataframe(ltv_df.style.format({
+        "新規顧客数": "{:,.0f}", "リピート注文数": "{:,.0f}", "リピート売上 (円)": "¥{:,.0f}",
+        "CAC (円)": "¥{:,.0f}", "LTV (円)": "¥{:,.0f}", "LTV/CAC": "{:.2f}倍"}), use_container_width=True)
+
+    rep = df_all.groupby(["プラン", "月番号", "月"], sort=False, observed=True)[["売上 (円)", "リピート売上 (円)"]].sum().reset_index()
+    rep["新規売上 (円)"] = rep["売上 (円)"] - rep["リピート売上 (円)"]
+    rep = rep.melt(id_vars=["プラン", "月番号", "月"], value_vars=["新規売上 (円)", "リピート売上 (円)"],
+                   var_name="区分", value_name="金額 (円)")
+    frep = px.bar(rep, x="月", y="金額 (円)", color="区分", barmode="stack",
+        facet_col="プラン" if len(plans_list) > 1 else None,
+        facet_col_wrap=5 if len(plans_list) > LARGE_N_PLANS else 0,
+        color_discrete_map={"新規売上 (円)": "#3b82f6", "リピート売上 (円)": "#10b981"},
+        category_orders={"月": month_labels, "プラン": plans_list})
+    frep.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff",
+        height=400 if len(plans_list) <= LARGE_N_PLANS else 170 * -(-len(plans_list) // 5) + 80,
+        font=dict(family="Noto Sans JP", size=11, color="#1e293b"),
+        legend=dict(orientation="h", y=1.12, x=0.5, xanchor="center", font=dict(color="#1e293b")),
+        margin=dict(l=20,r=20,t=60,b=20))
+    frep.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1], font=dict(color="#1e293b")))
+    plotly_chart(frep, use_container_width=True)
+
+prof.lap("inventory_view")
+
+# ══════════════════════════════════════════════
+# Inventory & Cash Flow (both modes, optional)
+# ══════════════════════════════════════════════
+if inv_settings:
+    st.markdown('<div class="section-header">📦 在庫・キャッシュフロー</div>', unsafe_allow_html=True)
+    with st.expander("ℹ️ この分析の見方", expanded=False):
+        st.markdown("""
+        - **欠品損失**: 在庫切れで取りこぼした売上（売上・限界利益はこの分を差し引いた値です）
+        - **入金額**: モール手数料控除後の売上。モールごとの入金サイト（Amazon 約2週間、楽天・Yahoo! 翌月など）で後ろにずれます
+        - **月末現預金**: 期首現預金 ＋ 入金 − 仕入支払 − 広告費 − 在庫保管料 の累計
+        """)
+
+    flow_cols = ["入金額 (円)", "仕入支払 (円)", "広告費 (円)", "在庫保管料 (円)", "キャッシュフロー (円)", "欠品損失 (円)"]
+    cash = df_all.groupby(["プラン", "月番号", "月"], sort=False, observed=True)[flow_cols].sum().reset_index()
+    cash["月末現預金 (円)"] = cash.groupby("プラン", observed=True)["キャッシュフロー (円)"].cumsum() + inv_settings["opening_cash"]
+
+    by_plan = cash.groupby("プラン", observed=True, sort=False)
+    low = cash.loc[by_plan["月末現預金 (円)"].idxmin()].set_index("プラン")
+    inv_df = pd.DataFrame({"年間欠品損失 (円)": by_plan["欠品損失 (円)"].sum(),
+                           "年間在庫保管料 (円)": by_plan["在庫保管料 (円)"].sum(),
+                           "最低月末現預金 (円)": low["月末現預金 (円)"], "最低月": low["月"].astype(str),
+                           "期末現預金 (円)": by_plan["月末現預金 (円)"].last()})
+    short = low[low["月末現預金 (円)"] < 0]
+    if len(short) > 3:
+        st.warning(f"⚠️ {len(short)}プランで期中に現預金がマイナスになります（最低 ¥{short['月末現預金 (円)'].min():,.0f}）。")
+    else:
+        for pname, r in short.iterrows():
+            st.warning(f"⚠️ **{pname}** は {r['月']} に現預金がマイナス（¥{r['月末現預金 (円)']:,.0f}）になります。")
+    dataframe(inv_df.rename_axis("プラン").style.format(
+        {c: "¥{:,.0f}" for c in ["年間欠品損失 (円)", "年間在庫保管料 (円)", "最低月末現預金 (円)", "期末現預金 (円)"]}),
+        use_container_width=True)
+
+    if len(plans_list) > LARGE_N_PLANS:
+        fcash = plan_heatmap(cash.pivot_table(index="プラン", columns="月", values="月末現預金 (円)",
+                                              aggfunc="sum", observed=True), "月末現預金 (円)", diverging=True)
+    else:
+        fcash = px.line(cash, x="月", y="月末現預金 (円)", color="プラン", markers=True,
+            color_discrete_map=plan_colors, category_orders={"月": month_labels, "プラン": plans_list})
+        fcash.update_layout(plot_bgcolor="#fafbfc", paper_bgcolor="#fff", height=380,
+            font=dict(family="Noto Sans JP", size=12, color="#1e293b"),
+            legend=dict(orientation="h", y=1.08, x=0.5, xanchor="center", font=dict(color="#1e293b")),
+            yaxis_title="月末現預金 (円)", xaxis_title="", margin=dict(l=20,r=20,t=40,b=20),
+            xaxis=dict(tickfont=dict(color="#1e293b")), yaxis=dict(tickfont=dict(color="#1e293b")))
+    plotly_chart(fcash, use_container_width=True)
+
+prof.lap("report")
+
+# ══════════════════════════════════════════════
+# Client Report (both modes)
+# ══════════════════════════════════════════════
+from pathlib import Path
+import report
+
+st.markdown('<div class="section-header">📄 クライアント向けレポート</div>', unsafe_allow_html=True)
+rc1, rc2, rc3 = st.columns([3, 1, 1])
+with rc1:
+    report_client = st.text_input("クライアント名", key="report_client", placeholder="株式会社〇〇")
+with rc2:
+    report_formats = ["html", "pdf"] if report.pdf_available() else ["html"]
+    report_fmt = st.selectbox("形式", report_formats, format_func=str.upper, key="report_fmt",
+        help=None if "pdf" in report_formats else "PDF 出力には kaleido と weasyprint が必要です。")
+with rc3:
+    st.write("")
+    if st.button("🖨 レポートを作成", use_container_width=True):
+        # 作成はワーカープロセスで行い、この画面の rerun はブロックしない
+        st.session_state["report_job"] = report.submit({
+            "client": report_client, "params": sim_params, "plans": sim_plans,
+            "rules": rec_rules if is_multi_plan else None,
+            "rank_by": rank_by if is_multi_plan else "order",
+            "baseline": base_plan if is_multi_plan else None,
+            "reference": ref_plan if is_multi_plan else None,
+        }, report_fmt)
+        st.session_state.pop("report_file", None)
+
+
+@st.fragment(run_every=1.0 if "report_job" in st.session_state else None)
+def report_status():
+    job = st.session_state.get("report_job")
+    if job is not None:
+        if not job.done():
+            st.info("⏳ レポートを作成中です…（他の操作は続けられます）")
+            return
+        del st.session_state["report_job"]
+        try:
+            st.session_state["report_file"] = job.result()
+        except Exception as e:
+            st.error(f"⚠️ レポートを作成できませんでした: {e}")
+            return
+        st.rerun()   # 完了したらポーリングを止める
+    path = st.session_state.get("report_file")
+    if path and Path(path).exists():
+        path = Path(path)
+        st.download_button(f"📥 {path.name}", path.read_bytes, path.name, report.MIME[path.suffix[1:]])
+
+
+report_status()
+
+prof.lap("footer")
 
 # ══════════════════════════════════════════════
 # Glossary & Footer (both modes)
@@ -813,6 +1208,9 @@ with st.expander("ℹ️ 用語の説明", expanded=False):
     | **楽天SS** | 楽天スーパーSALE（年4回） |
     | **PRオプション** | Yahoo!の検索上位表示オプション |
     | **季節指数** | 月別需要変動係数（1.0=平月） |
+    | **LTV / CAC** | 顧客生涯価値（粗利ベース）÷ 新規顧客獲得単価 |
+    | **発注点** | 在庫＋発注残がこの水準を下回ると補充発注する在庫水準 |
+    | **入金サイト** | 売上が発生してからモールから入金されるまでの期間 |
     """)
 
 st.markdown("---")
@@ -820,3 +1218,18 @@ st.markdown(
     "<div style='text-align:center;color:#94a3b8;font-size:0.78rem;'>"
     "EC 3大モール売上・利益シミュレーター v3.0 ｜ 3プラン比較機能搭載 ｜ シミュレーション結果は概算値です。"
     "</div>", unsafe_allow_html=True)
+
+# ══════════════════════════════════════════════
+# Debug panel (hidden; ?debug=1 or EC_SIM_DEBUG=1)
+# ══════════════════════════════════════════════
+if prof.enabled:
+    prof.finish()
+    with st.sidebar:
+        with st.expander("🛠 デバッグ: rerun 計測", expanded=True):
+            st.checkbox("サンプリングプロファイラ", key="prof_sampling",
+                help="次回の rerun からスタックを 5ms 間隔で採取します。")
+            st.caption(f"合計 {prof.total_ms:,.1f} ms（子の呼び出しは親の区間にも含まれます）")
+            st.dataframe(pd.DataFrame(prof.rows()), hide_index=True, use_container_width=True)
+            st.caption(f"結果キャッシュ: {result_cache.stats}")
+            st.download_button("📥 JSON", prof.to_json(), "rerun_profile.json", "application/json")
+            st.download_button("📥 flamegraph (folded)", prof.folded(), "rerun_profile.folded", "text/plain")
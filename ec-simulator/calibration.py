@@ -0,0 +1,251 @@
+"""
+実績データの取り込みとパラメータ推定（キャリブレーション）
+モール管理画面（楽天 RMS / Amazon Seller Central / Yahoo! ストアクリエイター）から書き出した
+月次・日次の実績 CSV を読み込み、base_cvr・target_cpc・organic_traffic_base・季節指数 12ヶ月分を
+対数誤差の最小二乗（Levenberg-Marquardt 法）で推定する。
+
+予測値はエンジン (engine.simulate_arrays) で計算する。候補パラメータ × 実績の年を「プラン」として
+並べるため、ヤコビアンの差分計算（パラメータ数 + 1 候補）も減衰係数の試行も 1 回の呼び出しで済む。
+"""
+import io
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import engine
+import malls
+
+# 管理画面ごとの列名の揺れ（先に見つかったものを使う）
+COLUMN_ALIASES = {
+    "month": ["年月", "月", "期間", "日付", "集計期間", "date", "Date", "month"],
+    "sales": ["売上 (円)", "売上", "売上金額", "売上合計値", "注文商品の売上額", "Ordered Product Sales", "sales"],
+    "traffic": ["アクセス数", "アクセス人数", "訪問者数", "セッション", "セッション - 合計", "Sessions", "sessions"],
+    "ad": ["広告費 (円)", "広告費", "広告費用", "ad_spend", "Ad Spend"],
+    "orders": ["注文数", "注文件数", "売上件数", "Total Order Items", "orders"],
+    "mall": ["モール", "mall"],
+}
+# モール列がない CSV は、その管理画面に固有の列名からモールを判定する
+MALL_SIGNATURES = {
+    "Amazon": ["注文商品の売上額", "Ordered Product Sales", "セッション - 合計", "Sessions"],
+    "楽天市場": ["売上金額", "アクセス人数"],
+    "Yahoo!": ["売上合計値", "訪問者数"],
+}
+FILENAME_HINTS = {"amazon": "Amazon", "rakuten": "楽天市場", "楽天": "楽天市場", "yahoo": "Yahoo!"}
+
+
+def _read_csv(data):
+    for enc in ("utf-8-sig", "cp932"):
+        try:
+            return pd.read_csv(io.BytesIO(data), encoding=enc, thousands=",")
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("CSV の文字コードを判別できません（UTF-8 / Shift_JIS に対応）")
+
+
+def _find(columns, names):
+    return next((c for c in names if c in columns), None)
+
+
+def _to_number(s):
+    if not pd.api.types.is_numeric_dtype(s):
+        s = s.astype(str).str.replace(r"[¥￥,円\s]", "", regex=True)
+    return pd.to_numeric(s, errors="coerce")
+
+
+def _to_month(s):
+    text = s.astype(str).str.strip()
+    text = text.str.replace(r"(\d{4})年\s*(\d{1,2})月?", r"\1-\2", regex=True)
+    text = text.str.replace(r"^(\d{4})[/-]?(\d{1,2})$", r"\1-\2-01", regex=True)
+    return pd.to_datetime(text, errors="coerce").dt.to_period("M")
+
+
+def load_actuals(files):
+    """実績 CSV（アップロードファイル・パス・バイト列のリスト）をモール × 年月の月次実績にまとめる
+
+    返り値の列: モール, 年月 (Period), 売上 (円), アクセス数, 広告費 (円), 注文数（無い列は NaN）
+    """
+    frames = []
+    for f in files:
+        name = getattr(f, "name", str(f))
+        if isinstance(f, (str, Path)):
+            data = Path(f).read_bytes()
+        elif isinstance(f, bytes):
+            data, name = f, ""
+        else:
+            data = f.getvalue()
+        raw = _read_csv(data)
+        cols = {k: _find(raw.columns, v) for k, v in COLUMN_ALIASES.items()}
+        if cols["month"] is None or cols["sales"] is None:
+            raise ValueError(f"{name}: 年月と売上の列が見つかりません（列名: {', '.join(map(str, raw.columns))}）")
+        out = pd.DataFrame({"年月": _to_month(raw[cols["month"]])})
+        for key, col in (("売上 (円)", "sales"), ("アクセス数", "traffic"), ("広告費 (円)", "ad"), ("注文数", "orders")):
+            out[key] = _to_number(raw[cols[col]]) if cols[col] else np.nan
+        if cols["mall"]:
+            out["モール"] = raw[cols["mall"]].astype(str).str.strip()
+        else:
+            mall = next((m for m, sig in MALL_SIGNATURES.items() if any(c in raw.columns for c in sig)), None)
+            mall = mall or next((m for h, m in FILENAME_HINTS.items() if h in name.lower()), None)
+            if mall is None:
+                raise ValueError(f"{name}: モールを判定できません。「モール」列を追加してください")
+            out["モール"] = mall
+        frames.append(out.dropna(subset=["年月"]))
+
+    df = pd.concat(frames, ignore_index=True)
+    unknown = sorted(set(df["モール"]) - set(malls.MALLS))
+    if unknown:
+        raise ValueError(f"未登録のモールです: {', '.join(unknown)}")
+    # 日次データは月次に合計する（min_count=1: 全て欠損の月は NaN のまま）
+    return (df.groupby(["モール", "年月"], sort=True)
+              .sum(min_count=1).reset_index())
+
+
+class _Problem:
+    """実績を (年, モール, 月) の配列に並べ、候補パラメータの一括評価と残差計算を行う"""
+
+    def __init__(self, actuals, params):
+        self.malls = [m for m in malls.MALLS if m in set(actuals["モール"])]
+        years = sorted({p.year for p in actuals["年月"]})
+        self.years = years
+        Y, M = len(years), len(self.malls)
+        yi = actuals["年月"].map(lambda p: years.index(p.year)).to_numpy()
+        mi = actuals["モール"].map(self.malls.index).to_numpy()
+        ti = actuals["年月"].map(lambda p: p.month - 1).to_numpy()
+
+        def grid(col):
+            g = np.full((Y, M, 12), np.nan)
+            g[yi, mi, ti] = actuals[col].to_numpy(dtype=float)
+            return g
+
+        self.sales = grid("売上 (円)")
+        self.traffic = grid("アクセス数")
+        # 広告費はエンジンと同じくモールごとの額として流入に効く。実績がない月はサイドバーの月間広告予算を使う
+        ad = grid("広告費 (円)")
+        self.ad = np.where(np.isnan(ad), params["ad_budget_monthly"], ad)   # (Y, M, 12)
+        self.sales_ok = self.sales > 0
+        self.traffic_ok = self.traffic > 0
+        self.has_traffic = bool(self.traffic_ok.any())
+
+        self.params = {**params, "active_malls": self.malls, "cohort": None, "inventory": None}
+        orders = actuals["注文数"].sum(min_count=1)
+        if orders and orders > 0:
+            self.params["average_order_value"] = float(actuals["売上 (円)"].sum() / orders)
+
+    def predict(self, theta):
+        """theta (C, 15) の全候補を 1 回のエンジン呼び出しで評価し、売上・アクセス数 (C, Y, M, 12) を返す"""
+        C, Y = len(theta), len(self.years)
+        v = np.exp(theta)
+        p = dict(self.params)
+        p["base_cvr"] = np.repeat(v[:, 0], Y)
+        p["target_cpc"] = np.repeat(v[:, 1], Y)
+        p["organic_traffic_base"] = np.repeat(v[:, 2], Y)
+        p["seasonality"] = np.repeat(v[:, 3:], Y, axis=0)
+        p["ad_budget_monthly"] = np.tile(self.ad, (C, 1, 1))
+        a = engine.simulate_arrays(p, {i: (1.0, 1.0, 1.0) for i in range(C * Y)})
+        shape = (C, Y, len(self.malls), 12)
+        return a["sales"].reshape(shape), a["traffic"].reshape(shape)
+
+    def residuals(self, theta, theta0):
+        """対数誤差 + 季節指数の水準固定 + 初期値への弱い正則化 (C, n_res)"""
+        sales, traffic = self.predict(theta)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = [(np.log(sales) - np.log(self.sales))[:, self.sales_ok]]
+            if self.has_traffic:
+                r.append((np.log(traffic) - np.log(self.traffic))[:, self.traffic_ok])
+        r.append(theta[:, 3:].mean(axis=1, keepdims=True) * 10.0)   # 季節指数 × 流入規模の不定性を固定
+        r.append((theta - theta0) * 0.01)
+        res = np.concatenate(r, axis=1)
+        return np.where(np.isfinite(res), res, 1e3)
+
+
+def fit(actuals, params, max_iter=50, tol=1e-9):
+    """実績にエンジンを当てはめ、推定パラメータと適合度を返す
+
+    params: サイドバーの入力値（初期値とモール固有設定に使う）
+    実績が推定に足りない（売上のある月がない・1〜12月が揃わない・実績値が推定する項目数より少ない）ときは ValueError
+    返り値: {"params": 推定値, "fixed": 推定しなかった項目, "report": モール別適合度 DataFrame,
+            "fitted": 実績と推定の比較 DataFrame, "r2", "mape", "iterations"}
+    """
+    prob = _Problem(actuals, params)
+    init = [params["base_cvr"], max(params["target_cpc"], 1), max(params["organic_traffic_base"], 1),
+            *params["seasonality"]]
+    theta = np.log(np.asarray(init, dtype=float))
+    theta0 = theta.copy()
+    # アクセス数がない実績では CVR と流入規模を分離できないため、CVR はサイドバーの値に固定する
+    fixed = [] if prob.has_traffic else [0]
+    free = np.delete(np.eye(len(theta)), fixed, axis=0)          # (推定する項目数, 15)
+    # 推定できない実績で入力欄を上書きしないよう、データ不足は例外にする（アプリは入力値を変えない）
+    n_obs = int(prob.sales_ok.sum() + prob.traffic_ok.sum())
+    n_months = int(prob.sales_ok.any(axis=(0, 1)).sum())
+    if not prob.sales_ok.any():
+        raise ValueError("売上が 0 より大きい月がありません")
+    if n_months < 12 or n_obs < len(free):
+        raise ValueError(f"推定には 1〜12月の各月の売上実績と {len(free)} 件以上の実績値が必要です"
+                         f"（売上のある月: {n_months}ヶ月、実績値: {n_obs} 件）")
+    lam, h = 1e-2, 1e-5
+    r = prob.residuals(theta[None], theta0)[0]
+    cost = r @ r
+    it = 0
+    for it in range(1, max_iter + 1):
+        res = prob.residuals(np.vstack([theta, theta + free * h]), theta0)
+        J = (res[1:] - res[0]).T / h
+        g, A = J.T @ r, J.T @ J
+        # 減衰係数を複数同時に試し、最も誤差が小さいステップを採用する
+        lams = lam * np.array([0.1, 1.0, 10.0, 100.0])
+        steps = np.array([np.linalg.solve(A + l * np.diag(np.diag(A) + 1e-12), -g) for l in lams]) @ free
+        trial = prob.residuals(theta + steps, theta0)
+        costs = np.einsum("ij,ij->i", trial, trial)
+        best = int(np.argmin(costs))
+        if costs[best] >= cost:
+            lam *= 100.0
+            if lam > 1e8:
+                break
+            continue
+        improved = cost - costs[best]
+        theta, r, cost, lam = theta + steps[best], trial[best], costs[best], max(lams[best] * 0.3, 1e-9)
+        if improved < tol * max(cost, 1.0):
+            break
+
+    v = np.exp(theta)
+    # 季節指数は平均 1.0 に正規化し、その分を自然流入数に戻す（予測値は変わらない）
+    scale = v[3:].mean()
+    v[3:] /= scale
+    v[2] *= scale
+
+    sales, traffic = prob.predict(np.log(v)[None])
+    sales, traffic = sales[0], traffic[0]
+    fitted_params = {
+        "base_cvr": float(v[0]), "target_cpc": float(v[1]), "organic_traffic_base": float(v[2]),
+        "seasonality": [float(x) for x in v[3:]],
+        "average_order_value": float(prob.params["average_order_value"]),
+    }
+
+    rows, parts = [], []
+    for m, name in enumerate(prob.malls):
+        ok = prob.sales_ok[:, m]
+        act, pred = prob.sales[:, m][ok], sales[:, m][ok]
+        rows.append({"モール": name, "月数": int(ok.sum()), "R²": _r2(act, pred),
+                     "MAPE (%)": float(np.mean(np.abs(pred / act - 1)) * 100)})
+        y, t = np.nonzero(ok)
+        parts.append(pd.DataFrame({
+            "モール": name, "年月": [pd.Period(year=prob.years[a], month=b + 1, freq="M") for a, b in zip(y, t)],
+            "実績売上 (円)": act, "推定売上 (円)": np.round(pred),
+            "実績アクセス数": prob.traffic[:, m][ok], "推定アクセス数": np.round(traffic[:, m][ok]),
+        }))
+    ok = prob.sales_ok
+    return {
+        "params": fitted_params,
+        "fixed": ["base_cvr"] if fixed else [],
+        "report": pd.DataFrame(rows),
+        "fitted": pd.concat(parts, ignore_index=True).sort_values(["年月", "モール"], ignore_index=True),
+        "r2": _r2(prob.sales[ok], sales[ok]),
+        "mape": float(np.mean(np.abs(sales[ok] / prob.sales[ok] - 1)) * 100),
+        "iterations": it,
+    }
+
+
+def _r2(actual, pred):
+    if len(actual) == 0:
+        return float("nan")
+    ss = ((actual - actual.mean()) ** 2).sum()
+    return float(1 - ((actual - pred) ** 2).sum() / ss) if ss > 0 else float("nan")
@@ -0,0 +1,58 @@
+"""
+コホート（リピート購入）・LTV モデル（オプションのステージ）
+エンジンが計算した注文を新規顧客の初回注文とみなし、(プラン × モール × 獲得月) の
+コホートにリテンションカーブを適用してリピート注文・リピート売上・顧客 LTV を計算する。
+
+コホート三角行列は経過月数ごとのシフト加算で更新するため、ループはラグの数だけで
+プラン・モール・月の次元はすべて配列演算になる。
+"""
+import numpy as np
+
+DEFAULTS = {
+    "repeat_rate": 0.10,      # 獲得 1ヶ月後のリピート率
+    "decay": 0.5,             # リテンションの減衰（経過月数 k に対し k^-decay）
+    "repeat_aov_mult": 1.0,   # リピート注文の客単価倍率
+    "ltv_months": 24,         # LTV の算出期間 (ヶ月)
+    "prime_share": 0.5,       # Amazon のプライム会員比率
+}
+
+
+def retention_curve(retention_mult, cfg, horizon):
+    """経過月数 1..horizon の再購入率 (M, horizon)"""
+    k = np.arange(1, horizon + 1)
+    base = cfg["repeat_rate"] * k ** (-cfg["decay"])
+    return np.clip(retention_mult[:, None] * base[None], 0.0, 1.0)
+
+
+def simulate(arrays, params, cfg, mall):
+    """エンジンの (P, M, T) 配列にリピート注文を加算し、更新した配列の辞書を返す"""
+    aov = params["average_order_value"]
+    new = arrays["sales"] / aov                                  # (P, M, T) 新規注文数
+    T = new.shape[-1]
+    horizon = max(int(cfg["ltv_months"]), T)
+    curve = retention_curve(mall["retention_mult"], cfg, horizon)
+
+    # repeat[t] = Σ_k new[t-k] × curve[k]
+    repeat = np.zeros_like(new)
+    for k in range(1, T):
+        repeat[..., k:] += new[..., :-k] * curve[None, :, k - 1, None]
+
+    repeat_aov = aov * cfg["repeat_aov_mult"]
+    repeat_sales = repeat * repeat_aov
+    sales = arrays["sales"] + repeat_sales
+    cogs = sales * params["cogs_rate"]
+    fee = sales * arrays["fee_rate"]
+
+    # 顧客 1 人あたり LTV = 初回注文の粗利 + ltv_months 内のリピート粗利の期待値（広告費控除前）
+    margin_rate = 1 - params["cogs_rate"] - arrays["fee_rate"].mean(axis=-1)   # (P, M)
+    expected_repeats = curve[:, :int(cfg["ltv_months"])].sum(axis=1)           # (M,)
+    ltv = margin_rate * (aov + repeat_aov * expected_repeats[None])
+
+    out = dict(arrays)
+    out.update({
+        "sales": sales, "cogs": cogs, "fee": fee,
+        "profit": sales - cogs - fee - arrays["ad"],
+        "new_orders": new, "repeat_orders": repeat, "repeat_sales": repeat_sales,
+        "ltv": np.broadcast_to(ltv[..., None], new.shape),
+    })
+    return out
@@ -0,0 +1,45 @@
+"""
+入力の初期値とプランの既定値
+アプリのサイドバーと report.py の CLI（上書きしなかった値）の両方がここを参照する。
+"""
+import malls
+
+DEFAULT_SEASONALITY = [0.9, 0.8, 1.2, 1.0, 1.0, 1.3, 1.2, 0.9, 1.2, 1.0, 1.1, 1.5]
+
+# engine.simulate に渡す params の初期値（サイドバーの初期値）
+DEFAULT_PARAMS = {
+    "active_malls": [name for name, spec in malls.MALLS.items() if spec["default"]],
+    "seasonality": DEFAULT_SEASONALITY,
+    "ad_budget_monthly": 500_000, "target_cpc": 50, "organic_traffic_base": 30_000, "base_cvr": 0.02,
+    "average_order_value": 5_000, "cogs_rate": 0.30,
+    "buy_box_pct": 0.90, "fba_usage": 0.80, "prime_day_boost": 2.5,
+    "ss_boost": 3.0, "point_mult": 5.0, "five_day_boost": 1.5, "pr_option_rate": 0.05,
+    "cohort": None, "inventory": None,
+}
+
+# 3プラン比較モードの初期値（Nプラン比較モードの表の初期行・CLI でプランを省いたときにも使う）
+PLAN_PRESETS = {
+    "🥈 シルバー": (0.5, 1.0, 1.0),
+    "🥇 ゴールド": (1.0, 1.05, 1.1),
+    "💎 プラチナ": (2.0, 1.15, 1.25),
+}
+PLAN_COLORS = {
+    "🥈 シルバー": "#94a3b8",
+    "🥇 ゴールド": "#f59e0b",
+    "💎 プラチナ": "#6366f1",
+}
+REFERENCE_PLAN = "🥇 ゴールド"
+LARGE_N_PLANS = 6   # これを超えるとカードは表、重ね描きのチャートはヒートマップ・小分けグラフにする（アプリ・レポート共通）
+
+
+def reference_index(names):
+    """基準プランの初期位置（REFERENCE_PLAN がなければ 2 番目のプラン）"""
+    return names.index(REFERENCE_PLAN) if REFERENCE_PLAN in names else min(1, len(names) - 1)
+
+
+def plan_color_map(names):
+    """プラン名 → 色。3プランの固定色以外はパレットから順に割り当てる（plotly は呼び出し時に読み込む）"""
+    import plotly.express as px
+
+    palette = px.colors.qualitative.Plotly + px.colors.qualitative.Dark24 + px.colors.qualitative.Light24
+    return {p: PLAN_COLORS.get(p, palette[i % len(palette)]) for i, p in enumerate(names)}
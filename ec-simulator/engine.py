@@ -0,0 +1,137 @@
+"""
+シミュレーションエンジン
+サイドバーの入力値（params）とプラン倍率から 12ヶ月 × モールの売上・利益を計算する。
+Streamlit に依存しない純粋関数なので、結果はパラメータだけで決まりキャッシュできる。
+
+モール固有のルールは malls.compile_malls() で (モール × 月) の配列に変換してから
+(プラン × モール × 月) のブロードキャストで一括計算するため、モール数・プラン数が増えても
+Python レベルのループは増えない。
+
+後段ステージ（設定がある場合のみ、この順に適用）:
+- params["cohort"]: リピート購入・LTV (cohort.py)。リピート売上を売上・利益に加算する
+- params["inventory"]: 在庫・キャッシュフロー (inventory.py)。欠品による機会損失を売上・利益に反映する
+
+base_cvr / target_cpc / organic_traffic_base はプランごとの (P,) 配列、
+seasonality / ad_budget_monthly は (P, 12) 配列、ad_budget_monthly は (P, M, 12) 配列でも
+指定できる（calibration.py の一括評価用。広告予算はモールごとの額）。
+プランは何件でも 1 回の呼び出しでまとめて計算する（広告予算はプラン × モール単位で上書き可）。
+"""
+import numpy as np
+
+import cohort
+import inventory
+import malls
+from results import SimResult
+
+# 計算結果が変わる修正（engine / malls / cohort / inventory）をしたら上げる。
+# result_cache のキーに含めるので、デプロイ後に旧ロジックの結果を返さない
+MODEL_VERSION = 2
+
+# 後段ステージ有効時に追加される列
+COHORT_COLUMNS = {
+    "新規注文数": "new_orders", "リピート注文数": "repeat_orders",
+    "リピート売上 (円)": "repeat_sales", "顧客LTV (円)": "ltv",
+}
+INVENTORY_COLUMNS = {
+    "欠品損失 (円)": "lost_sales", "在庫保管料 (円)": "storage", "仕入支払 (円)": "purchases",
+    "入金額 (円)": "payout", "キャッシュフロー (円)": "cash_flow",
+    "月末在庫 (個)": "stock_end", "欠品SKU数": "stockout_skus",
+}
+
+
+def simulate_arrays(params, plan_configs):
+    """全プラン × モール × 月を計算し、(P, M, 12) の配列の辞書を返す"""
+    p = params
+    names = p["active_malls"]
+    mall = malls.compile_malls(names, p)
+    configs = list(plan_configs.values())
+    mults = np.array([c[:3] for c in configs], dtype=float).reshape(-1, 3)
+    ad_mult, cvr_mult, trf_mult = mults[:, 0], mults[:, 1], mults[:, 2]
+    n_plan = len(mults)
+    si = np.broadcast_to(np.asarray(p["seasonality"], dtype=float), (n_plan, 12))
+
+    ad_budget = np.asarray(p["ad_budget_monthly"], dtype=float)
+    if ad_budget.ndim == 3:
+        plan_ad = ad_budget * ad_mult[:, None, None]                             # (P,M,12)
+    else:
+        ad_budget = np.broadcast_to(ad_budget.T, (12, n_plan)).T
+        plan_ad = np.repeat((ad_budget * ad_mult[:, None])[:, None, :], len(names), axis=1)  # (P,M,12)
+    # モール別の月間予算（上書き分だけ。プラン数 × 上書き数の代入で済む）
+    for i, c in enumerate(configs):
+        for name, budget in (c[3] if len(c) > 3 else {}).items():
+            if name in names:
+                plan_ad[i, names.index(name)] = budget
+    cpc = np.broadcast_to(np.asarray(p["target_cpc"], dtype=float), (n_plan,))[:, None, None]
+    ad_traffic = np.divide(plan_ad, cpc, out=np.zeros_like(plan_ad), where=cpc > 0)
+    base_traffic = ((p["organic_traffic_base"] * trf_mult)[:, None] * si)[:, None, :] + ad_traffic  # (P,M,12)
+    traffic = base_traffic * mall["traffic_boost"][None]                         # (P,M,12)
+
+    cvr = p["base_cvr"] * cvr_mult                                               # (P,)
+    for factor in malls.global_cvr_factors(p):
+        cvr = cvr * factor
+    cvr = (cvr[:, None] * mall["cvr_mult"][None])[:, :, None]                    # (P,M,1)
+
+    sales = traffic * cvr * p["average_order_value"] * mall["share"][None, :, None]
+    cogs = sales * p["cogs_rate"]
+    fee = sales * mall["fee_rate"][None]
+    profit = sales - cogs - fee - plan_ad
+    shape = traffic.shape
+    arrays = {
+        "traffic": traffic, "cvr": np.broadcast_to(cvr, shape), "sales": sales,
+        "cogs": cogs, "fee": fee, "ad": plan_ad,
+        "profit": profit, "fee_rate": np.broadcast_to(mall["fee_rate"][None], shape),
+        "seasonality": np.broadcast_to(si[:, None, :], shape),
+    }
+    if p.get("cohort"):
+        arrays = cohort.simulate(arrays, p, p["cohort"], mall)
+    if p.get("inventory"):
+        arrays = inventory.simulate(arrays, p, p["inventory"], mall)
+    return arrays
+
+
+def simulate(params, plan_configs):
+    """plan_configs = {プラン名: (広告倍率, CVR補正, 流入補正[, {モール名: 月間広告予算}])} の全プランを
+    計算して SimResult で返す（4 番目を指定したモールは広告倍率ではなくその予算で出稿する）
+
+    行の並びはプラン → 月 → モールの順。表示・集計には result.to_pandas() を使う。
+    """
+    names = list(params["active_malls"])
+    plans = list(plan_configs)
+    a = simulate_arrays(params, plan_configs)
+
+    def flat(x):
+        # (P, M, 12) → (P, 12, M) の順に並べ替えて 1 次元化
+        return np.ascontiguousarray(np.swapaxes(x, 1, 2)).ravel()
+
+    def yen(x):
+        return np.round(flat(x)).astype(np.int64)
+
+    measures = {
+        "アクセス数": yen(a["traffic"]),
+        "売上 (円)": yen(a["sales"]), "原価 (円)": yen(a["cogs"]),
+        "モール手数料 (円)": yen(a["fee"]), "広告費 (円)": yen(a["ad"]),
+        "限界利益 (円)": yen(a["profit"]),
+    }
+    for stage_key, columns in (("new_orders", COHORT_COLUMNS), ("lost_sales", INVENTORY_COLUMNS)):
+        if stage_key in a:
+            for col, key in columns.items():
+                measures[col] = yen(a[key])
+    # 月・プランによらない値は (P, M) / (P, 12) / (M, 12) のまま持つ
+    # CVR は旧実装と同じ Python の round（np.round は 10 進の丸めと 1e-4 ずれることがある。P × M 個だけなので十分速い）
+    return SimResult(plans, names, measures,
+                     cvr=[[round(float(v), 4) for v in row] for row in a["cvr"][:, :, 0]],
+                     seasonality=a["seasonality"][:, 0, :],
+                     fee_rate=a["fee_rate"][0])
+
+
+def row_positions(plans, names, plan=None, mall=None):
+    """simulate() の結果で plan / mall に一致する行番号（昇順）を返す。None は全件
+
+    行の並び（プラン → 月 → モール）から位置を直接計算するので、結果の行数によらず
+    列の走査やコピーは発生しない。
+    """
+    n_mall = len(names)
+    p = np.arange(len(plans)) if plan is None else np.array([list(plans).index(plan)])
+    m = np.arange(n_mall) if mall is None else np.array([list(names).index(mall)])
+    t = np.arange(12)
+    return ((p[:, None, None] * 12 + t[None, :, None]) * n_mall + m[None, None, :]).ravel()
@@ -0,0 +1,116 @@
+"""
+在庫・欠品・キャッシュフロー シミュレーション（オプションの後段ステージ）
+エンジンが計算した需要（売上 ÷ 客単価）を SKU に配分し、月次のステートマシンで
+在庫・発注・欠品・FBA保管料・モール入金・現預金を計算する。
+
+月のループ（12 ステップ）以外はすべて (プラン × モール × SKU) の配列演算なので、
+SKU 数が増えても Python レベルの処理量は変わらない。
+状態配列は (プラン × モール × SKU) の大きさになるため、プランを CHUNK_CELLS ずつに分けて計算し
+（ピークメモリを一定に抑える）、全体の大きさは MAX_CELLS までに制限する。
+"""
+import numpy as np
+
+DEFAULTS = {
+    "n_skus": 50,               # SKU数
+    "sku_skew": 1.0,            # 売れ筋集中度（SKU 別需要の Zipf 指数）
+    "initial_months": 2.0,      # 初期在庫（平均月間需要の何ヶ月分か）
+    "reorder_months": 1.0,      # 発注点
+    "order_up_to_months": 3.0,  # 発注上限（発注点を割ったらここまで補充）
+    "lead_time": 0,             # 発注から入荷までの追加月数（0 = 翌月入荷）
+    "storage_fee": 50,          # FBA 保管料 (円/個/月)
+    "opening_cash": 10_000_000, # 期首現預金 (円)
+}
+
+MAX_CELLS = 3_000_000   # プラン × モール × SKU の上限（サイドバーの SKU 数の上限はここから決める）
+CHUNK_CELLS = 500_000   # 1 回に状態を持つ プラン × モール × SKU の数
+
+
+def max_skus(n_plans, n_malls):
+    """プラン数・モール数に対して計算できる SKU 数の上限"""
+    return max(MAX_CELLS // max(n_plans * n_malls, 1), 1)
+
+
+def sku_weights(n_skus, skew):
+    """SKU 別の需要構成比（Zipf 分布）"""
+    w = 1.0 / np.arange(1, n_skus + 1) ** skew
+    return w / w.sum()
+
+
+def _shift_payout(net, lag):
+    """モールごとの入金サイト lag（ヶ月、小数可）で売上を後ろにずらす。期間外の入金は含まない"""
+    out = np.zeros_like(net)
+    n = net.shape[-1]
+    for m, l in enumerate(lag):
+        whole, frac = int(np.floor(l)), l - np.floor(l)
+        for k, w in ((whole, 1 - frac), (whole + 1, frac)):
+            if w > 0 and k < n:
+                out[:, m, k:] += w * net[:, m, :n - k]
+    return out
+
+
+def _run_states(demand, w, inv):
+    """月次のステートマシン。demand (P, M, T) → 販売数・発注数・月末在庫・欠品SKU数（各 (P, M, T)）"""
+    P, M, T = demand.shape
+    avg = demand.mean(axis=2)[..., None] * w                    # (P, M, S) 平均月間需要
+    rop = avg * inv["reorder_months"]
+    upto = np.maximum(avg * inv["order_up_to_months"], rop)
+    stock = avg * inv["initial_months"]
+    slots = int(inv["lead_time"]) + 1
+    pipeline = np.zeros((slots,) + stock.shape)                 # 入荷待ちのリングバッファ
+
+    sold = np.empty_like(demand)
+    ordered = np.empty_like(demand)
+    stock_end = np.empty_like(demand)
+    stockout_skus = np.empty(demand.shape, dtype=np.int64)
+    for t in range(T):
+        k = t % slots
+        stock = stock + pipeline[k]                             # 月初入荷
+        pipeline[k] = 0.0
+        d = demand[:, :, t, None] * w
+        s = np.minimum(stock, d)
+        stock = stock - s
+        position = stock + pipeline.sum(axis=0)
+        order = np.where(position <= rop, upto - position, 0.0)
+        pipeline[k] += order                                    # t + lead_time + 1 月の月初に入荷
+        sold[:, :, t] = s.sum(axis=-1)
+        ordered[:, :, t] = order.sum(axis=-1)
+        stock_end[:, :, t] = stock.sum(axis=-1)
+        stockout_skus[:, :, t] = (s < d - 1e-9).sum(axis=-1)
+    return sold, ordered, stock_end, stockout_skus
+
+
+def simulate(arrays, params, inv, mall):
+    """エンジンの (P, M, 12) 配列に在庫制約を適用し、更新した配列の辞書を返す
+
+    arrays: engine.simulate_arrays() の結果 / inv: DEFAULTS と同じキーの設定
+    mall: malls.compile_malls() の結果（payout_lag, storage_share を使う）
+    """
+    aov = params["average_order_value"]
+    unit_cost = aov * params["cogs_rate"]
+    demand = arrays["sales"] / aov                              # (P, M, T) 需要数量
+    P, M, T = demand.shape
+    n_skus = int(inv["n_skus"])
+    if n_skus > max_skus(P, M):
+        raise ValueError(f"SKU数は {P}プラン × {M}モールでは {max_skus(P, M):,} までです（指定 {n_skus:,}）")
+    w = sku_weights(n_skus, inv["sku_skew"])                    # (S,)
+    # プランはチャンクに分けて計算する（プラン間で状態は共有しないので結果は同じ）
+    step = max(CHUNK_CELLS // (M * n_skus), 1)
+    parts = [_run_states(demand[p:p + step], w, inv) for p in range(0, P, step)]
+    sold, ordered, stock_end, stockout_skus = (np.concatenate(x, axis=0) for x in zip(*parts))
+
+    sales = sold * aov
+    cogs = sales * params["cogs_rate"]
+    fee = sales * arrays["fee_rate"]
+    storage = stock_end * inv["storage_fee"] * mall["storage_share"][None, :, None]
+    purchases = ordered * unit_cost
+    payout = _shift_payout(sales - fee, mall["payout_lag"])
+    out = dict(arrays)
+    out.update({
+        "sales": sales, "cogs": cogs, "fee": fee,
+        "profit": sales - cogs - fee - arrays["ad"] - storage,
+        "lost_sales": arrays["sales"] - sales,
+        "storage": storage, "purchases": purchases, "payout": payout,
+        "cash_flow": payout - purchases - arrays["ad"] - storage,
+        "stock_end": stock_end, "stockout_skus": stockout_skus,
+    })
+    return out
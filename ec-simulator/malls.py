@@ -0,0 +1,129 @@
+"""
+モール定義レジストリ
+各モールの手数料・イベントカレンダー・CVR補正・カート取得率などをデータとして宣言し、
+compile_malls() でエンジンが使う (モール × 月) の配列に一度だけ変換する。
+
+値は数値か、サイドバー入力値 (params) のキー名で指定する。
+新しいモールは MALLS に追加するか register_mall() で登録する。
+
+    fee         手数料率の項目リスト（合計が手数料率）
+    fee_by_month  {月: 加算料率} 月別の追加手数料（キャンペーン負担など）
+    events      {月: 流入倍率}。"*" は毎月適用
+    cvr         [(値, 係数)] → CVR × (1 + 値 × 係数)
+    share       売上に掛かる取得率（Amazon のカート取得率など）
+    traffic_scale  共通流入に対するモールの流入規模
+    payout_lag  売上がモールから入金されるまでの月数（小数可）
+    storage     在庫のうちモール倉庫（FBA など）の保管料がかかる割合
+    retention   [(値, 係数)] → リピート率 × (1 + 値 × 係数)。params["cohort"] のキーも参照できる
+"""
+# 現行モデルでは店舗負担ポイントと FBA 利用率の CVR 補正を全モール共通で掛けている
+GLOBAL_CVR = [("point_mult", 0.01), ("fba_usage", 0.1)]
+
+MALLS = {
+    "Amazon": {
+        "label": "🟠 Amazon", "key": "use_amazon", "default": True, "color": "#FF9900",
+        "fee": [0.10],
+        "events": {7: "prime_day_boost"},
+        "share": "buy_box_pct",
+        "payout_lag": 0.5,  # 2週間ごとの入金
+        "storage": "fba_usage",
+        "retention": [("prime_share", 0.5)],
+    },
+    "楽天市場": {
+        "label": "🔴 楽天市場", "key": "use_rakuten", "default": True, "color": "#BF0000",
+        "fee": [0.06],
+        "events": {3: "ss_boost", 6: "ss_boost", 9: "ss_boost", 12: "ss_boost"},
+        "payout_lag": 1.0,
+        "retention": [("point_mult", 0.02)],
+    },
+    "Yahoo!": {
+        "label": "🔵 Yahoo!ショッピング", "key": "use_yahoo", "default": True, "color": "#FF0033",
+        "fee": [0.03, "pr_option_rate"],
+        "events": {"*": "five_day_boost"},
+        "payout_lag": 1.0,
+    },
+    "au PAY マーケット": {
+        "label": "🟤 au PAY マーケット", "key": "use_aupay", "default": False, "color": "#EB5505",
+        "fee": [0.05],
+        "events": {"*": 1.2},
+        "traffic_scale": 0.3,
+        "payout_lag": 1.0,
+    },
+    "Qoo10": {
+        "label": "🟣 Qoo10", "key": "use_qoo10", "default": False, "color": "#7C3AED",
+        "fee": [0.10],
+        "events": {3: 2.0, 6: 2.0, 9: 2.0, 11: 2.0},  # メガ割
+        "traffic_scale": 0.4,
+        "payout_lag": 1.0,
+    },
+    "自社EC": {
+        "label": "⚪ 自社EC", "key": "use_own_ec", "default": False, "color": "#0EA5E9",
+        "fee": [0.036],  # 決済手数料
+        "cvr": [(-0.2, 1.0)],
+        "traffic_scale": 0.2,
+        "payout_lag": 0.5,
+        "retention": [(0.3, 1.0)],  # 自社会員・メルマガによる再訪
+    },
+}
+
+
+def register_mall(name, **spec):
+    """モールを追加・上書きする"""
+    spec.setdefault("label", name)
+    spec.setdefault("key", f"use_mall_{len(MALLS)}")
+    spec.setdefault("default", False)
+    spec.setdefault("color", "#64748b")
+    MALLS[name] = spec
+
+
+def _value(v, params):
+    return params[v] if isinstance(v, str) else v
+
+
+def compile_malls(names, params):
+    """モール定義を (M,) / (M, 12) の配列に変換する
+
+    返り値: traffic_boost (M,12), fee_rate (M,12), cvr_mult (M,), share (M,),
+            payout_lag (M,), storage_share (M,), retention_mult (M,)
+    """
+    import numpy as np  # レジストリ自体はサイドバー描画前に使うため、numpy は計算時に読み込む
+
+    m = len(names)
+    boost = np.ones((m, 12))
+    fee = np.zeros((m, 12))
+    cvr = np.ones(m)
+    share = np.ones(m)
+    payout_lag = np.ones(m)
+    storage = np.zeros(m)
+    retention = np.ones(m)
+    lookup = {**params, **(params.get("cohort") or {})}
+    for i, name in enumerate(names):
+        spec = MALLS[name]
+        events = spec.get("events", {})
+        if "*" in events:
+            boost[i, :] = _value(events["*"], params)
+        for month, b in events.items():
+            if month != "*":
+                boost[i, month - 1] = _value(b, params)
+        boost[i] *= spec.get("traffic_scale", 1.0)
+        rate = 0.0
+        for term in spec.get("fee", []):
+            rate = rate + _value(term, params)
+        fee[i, :] = rate
+        for month, extra in spec.get("fee_by_month", {}).items():
+            fee[i, month - 1] += _value(extra, params)
+        for v, coef in spec.get("cvr", []):
+            cvr[i] *= 1 + _value(v, params) * coef
+        share[i] = _value(spec.get("share", 1.0), params)
+        payout_lag[i] = _value(spec.get("payout_lag", 1.0), params)
+        storage[i] = _value(spec.get("storage", 0.0), params)
+        if params.get("cohort"):
+            for v, coef in spec.get("retention", []):
+                retention[i] *= 1 + _value(v, lookup) * coef
+    return {"traffic_boost": boost, "fee_rate": fee, "cvr_mult": cvr, "share": share,
+            "payout_lag": payout_lag, "storage_share": storage, "retention_mult": retention}
+
+
+def global_cvr_factors(params):
+    """全モール共通の CVR 補正係数（掛ける順に並んだリスト）"""
+    return [1 + _value(v, params) * coef for v, coef in GLOBAL_CVR]
@@ -0,0 +1,149 @@
+"""
+再実行 (rerun) の計測レイヤー
+デバッグモード（URL に ?debug=1、または環境変数 EC_SIM_DEBUG=1）のときだけ有効になり、
+無効時はすべて何もしない（ラップした関数も元の関数をそのまま返す）。
+
+- lap(name): スクリプトの区間計測。次の lap() / finish() までを name の区間として記録する
+- wrap(func, name): 関数呼び出しを現在の区間の子として計測する（st.plotly_chart, st.dataframe など）
+- サンプリングプロファイラ: スクリプトスレッドのスタックを一定間隔で採取し、
+  flamegraph.pl / speedscope で読める folded 形式で出力する
+
+EC_SIM_PROFILE_DIR を設定すると、計測結果を rerun ごとに JSON で書き出す（本番セッションの収集用）。
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+
+class SamplingProfiler:
+    """対象スレッドのスタックを interval 秒ごとに採取する
+
+    stop() が呼ばれなくても max_seconds 経てば自分で終わる（rerun が途中で打ち切られたとき用）。
+    """
+
+    def __init__(self, thread_id, interval=0.005, max_seconds=120):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    def __init__(self, enabled=False, sampling=False, interval=0.005):
+        self.enabled = enabled
+        self.records = []          # {"path", "ms", "calls"}
+        self._current = None
+        self._t0 = self._lap_t0 = time.perf_counter()
+        self._sampler = SamplingProfiler(threading.get_ident(), interval).start() if enabled and sampling else None
+        self.total_ms = 0.0
+
+    def _add(self, path, ms):
+        for r in self.records:
+            if r["path"] == path:
+                r["ms"] += ms
+                r["calls"] += 1
+                return
+        self.records.append({"path": path, "ms": ms, "calls": 1})
+
+    def lap(self, name):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._current is not None:
+            self._add(self._current, (now - self._lap_t0) * 1000)
+        self._current, self._lap_t0 = name, now
+
+    def wrap(self, func, name):
+        if not self.enabled:
+            return func
+
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                parent = self._current or "script"
+                self._add(f"{parent};{name}", (time.perf_counter() - t0) * 1000)
+        return timed
+
+    def finish(self):
+        if not self.enabled:
+            return
+        self.lap(None)
+        self.total_ms = (time.perf_counter() - self._t0) * 1000
+        self.close()
+        out_dir = os.environ.get("EC_SIM_PROFILE_DIR")
+        if out_dir:
+            path = Path(out_dir)
+            path.mkdir(parents=True, exist_ok=True)
+            name = f"rerun-{datetime.now():%Y%m%d-%H%M%S-%f}-{threading.get_ident()}.json"
+            (path / name).write_text(self.to_json(), encoding="utf-8")
+
+    def close(self):
+        """サンプラーを止める（何度呼んでもよい）"""
+        if self._sampler:
+            self._sampler.stop()
+
+    def rows(self):
+        """区間ごとの表（子の呼び出し時間は親の区間にも含まれる）"""
+        order = {}
+        for r in self.records:
+            order.setdefault(r["path"].split(";")[0], len(order))
+        records = sorted(self.records, key=lambda r: (order[r["path"].split(";")[0]], r["path"].count(";")))
+        return [{"区間": r["path"].replace(";", " › "), "ms": round(r["ms"], 1), "呼び出し": r["calls"]}
+                for r in records]
+
+    def to_json(self):
+        return json.dumps({
+            "total_ms": round(self.total_ms, 2),
+            "stages": [{**r, "ms": round(r["ms"], 3)} for r in self.records],
+            "samples": dict(self._sampler.stacks) if self._sampler else {},
+        }, ensure_ascii=False, indent=2)
+
+    def folded(self):
+        """flamegraph 用の folded 形式。サンプリング無効時は区間計測（自己時間 µs）から作る"""
+        if self._sampler:
+            return self._sampler.folded()
+        child = Counter()
+        for r in self.records:
+            if ";" in r["path"]:
+                child[r["path"].split(";")[0]] += r["ms"]
+        lines = []
+        for r in self.records:
+            self_ms = r["ms"] - child.get(r["path"], 0.0)
+            lines.append(f"rerun;{r['path']} {max(int(self_ms * 1000), 0)}")
+        return "\n".join(lines)
+
+
+def is_debug(query_params):
+    return query_params.get("debug") == "1" or os.environ.get("EC_SIM_DEBUG") == "1"
@@ -0,0 +1,136 @@
+"""
+推奨プランの判定（ルールベース）
+プランごとの年間指標を (P,) の配列にまとめ、宣言したルール（指標・比較演算子・しきい値）を
+全プランに一括で適用して順位を付け、所見の文章をテンプレートから組み立てる。
+
+候補が 3 プランでも、パラメータ探索で作った 10 万プランでも同じ関数で評価できる
+（ルール 1 件が配列演算 1 回なので、10 万プランでも数ミリ秒）。
+"""
+import numpy as np
+
+OPS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal,
+       "==": np.equal, "!=": np.not_equal}
+
+# 推奨条件（すべて満たすプランが候補）。value には数値のほか指標名も書ける
+DEFAULT_RULES = [
+    {"metric": "profit", "op": ">", "value": 0},
+    {"metric": "inc_roas", "op": ">=", "value": 3.0},
+    {"metric": "profit_rate", "op": ">=", "value": 15.0},
+]
+
+# 所見のテンプレート。when のルールをすべて満たす行だけを、上から順に出力する
+COMMENT_TEMPLATES = [
+    {"text": "本シミュレーションの結果、<b>{plan}</b> を推奨します。"},
+    {"when": [{"metric": "is_baseline", "op": "==", "value": 0}],
+     "text": "{baseline_short}比で年間売上 <b>+¥{inc_sales:,.0f}</b>（<b>+{inc_pct:.0f}%</b>）が見込めます。"},
+    {"when": [{"metric": "is_baseline", "op": "==", "value": 0}],
+     "text": "追加投資 ¥{inc_ad:,.0f} に対し、追加利益 ¥{inc_profit:,.0f}（<b>{inc_roi:.1f}倍回収</b>）。"},
+    {"when": [{"metric": "aggressive_is_top", "op": "==", "value": 0},
+              {"metric": "aggressive_profit_rate", "op": "<", "value": "reference_profit_rate"}],
+     "text": "{aggressive_short}プランは利益率が {aggressive_profit_rate:.1f}% に低下するためリスクがあります。"},
+    {"when": [{"metric": "has_best_mall", "op": "==", "value": 1}],
+     "text": "モール別では <b>{best_mall}</b> の利益貢献が最も高い結果となりました。"},
+]
+
+
+def _ratio(num, den):
+    num, den = np.asarray(num, dtype=float), np.asarray(den, dtype=float)
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den > 0)
+
+
+def metrics(sales, profit, ad, mall_profit=None, baseline=0):
+    """プランごとの年間合計 (P,) から判定用の指標表（{指標名: (P,) 配列}）を作る
+
+    mall_profit: (P, M) のモール別限界利益（所見の最優秀モールに使う）
+    baseline: 追加投資の比較元プランの位置
+    """
+    sales, profit, ad = (np.asarray(x, dtype=float) for x in (sales, profit, ad))
+    inc_ad = ad - ad[baseline]
+    inc_sales = sales - sales[baseline]
+    inc_profit = profit - profit[baseline]
+    table = {
+        "order": np.arange(len(sales)),   # 並び順（後ろほど積極的な投資プラン）
+        "sales": sales, "profit": profit, "ad": ad,
+        "roas": _ratio(sales, ad),
+        "profit_rate": _ratio(profit, sales) * 100,
+        "inc_ad": inc_ad, "inc_sales": inc_sales, "inc_profit": inc_profit,
+        "inc_roas": _ratio(inc_sales, inc_ad),
+        "inc_roi": _ratio(inc_profit, inc_ad),
+        "inc_pct": _ratio(inc_sales, sales[baseline]) * 100,
+    }
+    if mall_profit is not None and np.shape(mall_profit)[1] > 0:
+        table["best_mall"] = np.argmax(mall_profit, axis=1)
+    return table
+
+
+def from_result(result, baseline=0):
+    """results.SimResult から指標表を作る"""
+    P, M = len(result.plans), len(result.malls)
+
+    def by_plan_mall(col):
+        return result.measures[col].reshape(P, 12, M).sum(axis=1)
+
+    mall_profit = by_plan_mall("限界利益 (円)")
+    return metrics(by_plan_mall("売上 (円)").sum(axis=1), mall_profit.sum(axis=1),
+                   by_plan_mall("広告費 (円)").sum(axis=1), mall_profit, baseline)
+
+
+def evaluate(table, rules):
+    """すべてのルールを満たすプランのマスク (P,)"""
+    n = len(table["sales"])
+    ok = np.ones(n, dtype=bool)
+    for rule in rules:
+        value = rule["value"]
+        rhs = table[value] if isinstance(value, str) else value
+        ok &= OPS[rule["op"]](table[rule["metric"]], rhs)
+    return ok
+
+
+def rank(table, rules, order_by="order", exclude=()):
+    """ルールを満たすプランの位置を推奨順（order_by の指標が大きい順。同値なら後ろのプラン優先）に並べて返す"""
+    ok = evaluate(table, rules)
+    ok[list(exclude)] = False
+    idx = np.flatnonzero(ok)
+    # 第1キー: order_by の大きい順、第2キー: 後ろのプラン優先
+    order = np.lexsort((-idx, -table[order_by][idx]))
+    return idx[order]
+
+
+def recommend(table, rules=DEFAULT_RULES, order_by="order", baseline=0):
+    """推奨プランの位置の配列（先頭が最推奨）。条件を満たすプランがなければ [baseline]"""
+    ranked = rank(table, rules, order_by, exclude=[baseline])
+    return ranked if len(ranked) else np.array([baseline])
+
+
+def _short(name):
+    # 先頭の絵文字を除いた名前（"🥈 シルバー" → "シルバー"）
+    return name.split(" ", 1)[-1]
+
+
+def comment(table, plans, top, baseline=0, reference=None, aggressive=None, malls=(),
+            templates=COMMENT_TEMPLATES):
+    """推奨プラン top の所見を 1 文ずつのリストで返す
+
+    reference: 利益率を比べる基準プラン（省略時は top）
+    aggressive: 最も積極的なプラン（省略時は最後のプラン）。推奨されず、基準より利益率が低い場合に
+    リスクとして言及する。
+    """
+    reference = top if reference is None else reference
+    aggressive = len(plans) - 1 if aggressive is None else aggressive
+    ctx = {k: v[top] for k, v in table.items() if k != "order"}
+    ctx.update({
+        "plan": plans[top], "baseline": plans[baseline], "baseline_short": _short(plans[baseline]),
+        "is_baseline": int(top == baseline),
+        "aggressive": plans[aggressive], "aggressive_short": _short(plans[aggressive]),
+        "aggressive_is_top": int(aggressive == top),
+        "aggressive_profit_rate": table["profit_rate"][aggressive],
+        "reference_profit_rate": table["profit_rate"][reference],
+        "has_best_mall": int("best_mall" in table),
+        "best_mall": malls[table["best_mall"][top]] if "best_mall" in table else "",
+    })
+    scalar = {k: np.atleast_1d(v) for k, v in ctx.items() if not isinstance(v, str)}
+    lines = []
+    for tpl in templates:
+        if evaluate(scalar, tpl.get("when", []))[0]:
+            lines.append(tpl["text"].format(**ctx))
+    return lines
@@ -0,0 +1,332 @@
+"""
+クライアント向けレポート（HTML / PDF）の生成
+プランカード・投資対効果・所見・月次チャート・プラン × モールのマトリクスを 1 ファイルにまとめる。
+
+- 計算結果は result_cache を通すので、アプリで表示中のシミュレーションはディスクキャッシュから再利用する
+- submit() はプロセスプールで作成するため、レポート作成中も他ユーザーの rerun は GIL を取り合わない
+- HTML はチャートを操作可能なまま 1 ファイルに埋め込む（plotly.js を内包するのでオフラインで開ける）
+- PDF はチャートを SVG に書き出して埋め込む（kaleido と weasyprint が必要）
+- アプリからの作成先（REPORT_DIR）は書き出しのたびに古いファイルを消す（CLI の出力先は消さない）
+
+CLI（複数クライアントの一括作成）:
+    python report.py clients.json --out reports --format html --workers 4
+
+clients.json はクライアントごとの {"client": 名前, "params": {サイドバー値の上書き},
+"plans": {プラン名: [広告倍率, CVR補正, 流入補正(, {モール名: 月間広告予算})]}, "baseline": 比較元プラン名} のリスト。
+"""
+import argparse
+import base64
+import html
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import defaults
+import malls
+
+REPORT_DIR = Path(os.environ.get("EC_SIM_REPORT_DIR", Path(tempfile.gettempdir()) / "ec-simulator-reports"))
+MAX_WORKERS = int(os.environ.get("EC_SIM_REPORT_WORKERS", "2"))
+MIME = {"html": "text/html", "pdf": "application/pdf"}
+# REPORT_DIR（アプリからの作成先）に残すファイル数と期間。CLI の --out は消さない
+MAX_REPORT_FILES = 200
+MAX_REPORT_AGE = 24 * 3600
+
+CSS = """
+body { font-family: 'Noto Sans JP', 'Hiragino Sans', 'Yu Gothic', sans-serif; color:#1e293b;
+       max-width:1100px; margin:0 auto; padding:24px; background:#fff; }
+header { background:linear-gradient(135deg,#0f1b2d,#234e78); color:#fff; padding:20px 28px; border-radius:12px; }
+header h1 { margin:0; font-size:1.5rem; } header p { margin:6px 0 0; opacity:.85; font-size:.85rem; }
+h2 { font-size:1.1rem; border-left:4px solid #2563eb; padding-left:10px; margin:28px 0 12px; }
+.cards { display:flex; flex-wrap:wrap; gap:12px; }
+.card { flex:1 1 30%; border:1px solid #e2e8f0; border-radius:12px; padding:14px; }
+.card h3 { margin:0 0 8px; font-size:1rem; } .card .label { font-size:.72rem; color:#64748b; margin:0; }
+.card .value { font-size:1.2rem; font-weight:700; margin:0 0 4px; }
+.card.top { border:2px solid #f59e0b; background:#fffbeb; }
+.consul { background:#ecfdf5; border-left:4px solid #10b981; border-radius:8px; padding:12px 18px; }
+.consul p { margin:4px 0; font-size:.9rem; line-height:1.7; }
+table { border-collapse:collapse; width:100%; font-size:.82rem; }
+th, td { border-bottom:1px solid #e2e8f0; padding:6px 10px; text-align:right; }
+th:first-child, td:first-child { text-align:left; } thead th { background:#f8fafc; }
+.chart img { width:100%; } footer { margin-top:32px; color:#94a3b8; font-size:.75rem; text-align:center; }
+@media print { body { padding:0; } section { break-inside:avoid; } }
+"""
+
+
+def pdf_available():
+    return all(importlib.util.find_spec(m) is not None for m in ("kaleido", "weasyprint"))
+
+
+def simulate(params, plans):
+    """アプリと同じキーで結果キャッシュを引く（表示中のシミュレーションは再計算しない）"""
+    import engine
+    import result_cache
+
+    specs = {m: malls.MALLS[m] for m in params["active_malls"]}
+    return result_cache.get_or_compute(result_cache.cache_key(params, plans, specs),
+                                       lambda: engine.simulate(params, plans))
+
+
+# --- 図表 ---
+def _heatmap(values, diverging=False):
+    """プラン × 列のヒートマップ（プラン数が多いときの重ね描きの代わり。アプリの plan_heatmap と同じ）"""
+    import plotly.express as px
+
+    fig = px.imshow(values, aspect="auto", text_auto=".3s", color_continuous_scale="RdBu" if diverging else "Blues",
+                    color_continuous_midpoint=0 if diverging else None)
+    fig.update_layout(coloraxis_colorbar=dict(title=""), xaxis_title="", yaxis_title="")
+    return fig
+
+
+def _figures(df, plans, mall_names, reference):
+    """[(タイトル, 図)]。プラン数が LARGE_N_PLANS を超えると重ね描きをヒートマップ・プラン別の小分けグラフにする"""
+    import pandas as pd
+    import plotly.express as px
+
+    colors = defaults.plan_color_map(plans)
+    mall_colors = {m: malls.MALLS[m]["color"] for m in mall_names}
+    order = {"プラン": plans, "月": list(df["月"].cat.categories)}
+    layout = dict(font=dict(family="Noto Sans JP", size=11, color="#1e293b"), height=360,
+                  margin=dict(l=10, r=10, t=40, b=10), plot_bgcolor="#fafbfc", paper_bgcolor="#fff",
+                  legend=dict(orientation="h", y=1.12, x=0.5, xanchor="center"))
+
+    monthly = (df.groupby(["プラン", "月"], observed=True)[["売上 (円)", "限界利益 (円)"]].sum().reset_index())
+    monthly["累積利益 (円)"] = monthly.groupby("プラン", observed=True)["限界利益 (円)"].cumsum()
+    if len(plans) > defaults.LARGE_N_PLANS:
+        def pivot(data, column, value):
+            return data.pivot_table(index="プラン", columns=column, values=value, aggfunc="sum", observed=True)
+
+        sales = px.line(monthly, x="月", y="売上 (円)", color="プラン", facet_col="プラン", facet_col_wrap=5,
+                        color_discrete_map=colors, category_orders=order)
+        sales.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+        sales.update_xaxes(title="", showticklabels=False)
+        sales.update_yaxes(title="", tickformat=".2s")
+        figs = [
+            ("月次売上推移（プラン別）", sales),
+            ("限界利益推移", _heatmap(pivot(monthly, "月", "限界利益 (円)"), diverging=True)),
+            ("累積利益", _heatmap(pivot(monthly, "月", "累積利益 (円)"), diverging=True)),
+            ("モール別売上", _heatmap(pivot(df, "モール", "売上 (円)"))),
+        ]
+        heights = [170 * -(-len(plans) // 5) + 80] + [max(360, 24 * len(plans) + 120)] * 3
+    else:
+        figs = [
+            ("月次売上推移", px.line(monthly, x="月", y="売上 (円)", color="プラン", markers=True,
+                                   color_discrete_map=colors, category_orders=order)),
+            ("限界利益推移", px.bar(monthly, x="月", y="限界利益 (円)", color="プラン", barmode="group",
+                                   color_discrete_map=colors, category_orders=order)),
+            ("累積利益", px.area(monthly, x="月", y="累積利益 (円)", color="プラン",
+                                color_discrete_map=colors, category_orders=order)),
+            ("モール別売上", px.bar(df.groupby(["プラン", "モール"], observed=True)["売上 (円)"].sum().reset_index(),
+                                   x="モール", y="売上 (円)", color="プラン", barmode="group",
+                                   color_discrete_map=colors, category_orders=order)),
+        ]
+        heights = [360] * 4
+    # 構成比は基準プランだけで見る（プランは択一の案なので合計には意味がない）
+    ref_df = df[df["プラン"] == reference]
+    cost = pd.DataFrame({"項目": ["原価", "モール手数料", "広告費", "限界利益"],
+                         "金額": [ref_df["原価 (円)"].sum(), ref_df["モール手数料 (円)"].sum(),
+                                  ref_df["広告費 (円)"].sum(), max(ref_df["限界利益 (円)"].sum(), 0)]})
+    figs.append((f"コスト構成（{reference}）", px.pie(cost, values="金額", names="項目", hole=0.45,
+        color_discrete_map={"原価": "#64748b", "モール手数料": "#f59e0b", "広告費": "#3b82f6", "限界利益": "#10b981"})))
+    share = ref_df.groupby("モール", observed=True)["売上 (円)"].sum().reset_index()
+    figs.append((f"モール構成比（{reference}）", px.pie(share, values="売上 (円)", names="モール", hole=0.45,
+                                                color_discrete_map=mall_colors)))
+    for (title, fig), height in zip(figs, heights + [360, 360]):
+        fig.update_layout(title=dict(text=title, font_size=14), **{**layout, "height": height})
+    if len(plans) > defaults.LARGE_N_PLANS:
+        figs[0][1].update_layout(showlegend=False)
+    return figs
+
+
+def _chart_html(fig, static, first):
+    if static:
+        svg = fig.to_image(format="svg", width=1000, height=fig.layout.height)
+        return f'<img src="data:image/svg+xml;base64,{base64.b64encode(svg).decode()}">'
+    # plotly.js は最初の図にだけ埋め込む
+    return fig.to_html(full_html=False, include_plotlyjs=first, config={"displayModeBar": False})
+
+
+def _yen_table(df):
+    return df.map(lambda v: f"¥{v:,.0f}").to_html(border=0, escape=True)
+
+
+def render_html(job, static=False):
+    """job: {"client", "params", "plans", "rules", "rank_by"} → 単一ファイルの HTML 文字列"""
+    import recommend
+
+    params, plans = job["params"], dict(job["plans"])
+    names = list(plans)
+    result = simulate(params, plans)
+    df = result.to_pandas()
+    baseline = names.index(job["baseline"]) if job.get("baseline") in names else 0
+    reference = (names.index(job["reference"]) if job.get("reference") in names
+                 else defaults.reference_index(names))
+    table = recommend.from_result(result, baseline=baseline)
+    multi = len(names) > 1
+    top = int(recommend.recommend(table, job.get("rules") or recommend.DEFAULT_RULES,
+                                  job.get("rank_by", "order"), baseline)[0]) if multi else 0
+    esc = html.escape
+    client = esc(job.get("client") or "")
+    title = esc(job.get("title") or "EC モール売上・利益シミュレーション レポート")
+
+    parts = [f"<header><h1>{title}</h1><p>{client + ' 様 ／ ' if client else ''}"
+             f"作成日 {datetime.now():%Y-%m-%d} ／ 対象モール: {esc('・'.join(result.malls))}</p></header>"]
+
+    if len(names) > defaults.LARGE_N_PLANS:
+        # プランが多いときはカードの代わりに表（増減率は基準プランとの差）
+        ref_sales, ref_profit = table["sales"][reference], table["profit"][reference]
+        sales_diff = (table["sales"] / ref_sales - 1) * 100 if ref_sales > 0 else table["sales"] * 0.0
+        profit_diff = (table["profit"] / ref_profit - 1) * 100 if ref_profit != 0 else table["profit"] * 0.0
+        rows = "".join(
+            f"<tr><td>{esc(name)}{' ★推奨' if i == top else ''}</td><td>¥{table['sales'][i]:,.0f}</td>"
+            f"<td>¥{table['profit'][i]:,.0f}</td><td>¥{table['ad'][i]:,.0f}</td><td>{table['roas'][i]:.2f}倍</td>"
+            f"<td>{table['profit_rate'][i]:.1f}%</td><td>{sales_diff[i]:+.1f}%</td><td>{profit_diff[i]:+.1f}%</td></tr>"
+            for i, name in enumerate(names))
+        ref_name = esc(names[reference])
+        parts.append(f"<section><h2>プラン比較サマリー（年間）</h2><table><thead><tr><th>プラン</th><th>年間売上</th>"
+                     f"<th>年間限界利益</th><th>年間広告費</th><th>ROAS</th><th>利益率</th><th>売上 対{ref_name}</th>"
+                     f"<th>利益 対{ref_name}</th></tr></thead><tbody>{rows}</tbody></table></section>")
+    else:
+        cards = []
+        for i, name in enumerate(names):
+            badge = " ★推奨" if multi and i == top else ""
+            cards.append(
+                f'<div class="card{" top" if multi and i == top else ""}"><h3>{esc(name)}{badge}</h3>'
+                f'<p class="label">年間売上</p><p class="value">¥{table["sales"][i]:,.0f}</p>'
+                f'<p class="label">年間限界利益</p><p class="value">¥{table["profit"][i]:,.0f}</p>'
+                f'<p class="label">年間広告費</p><p class="value">¥{table["ad"][i]:,.0f}</p>'
+                f'<p class="label">ROAS {table["roas"][i]:.2f}倍 ／ 利益率 {table["profit_rate"][i]:.1f}%</p></div>')
+        parts.append(f'<section><h2>プラン比較サマリー（年間）</h2><div class="cards">{"".join(cards)}</div></section>')
+
+    if multi:
+        rows = "".join(
+            f"<tr><td>{esc(names[i])}</td><td>¥{table['inc_ad'][i]:,.0f}</td><td>¥{table['inc_sales'][i]:,.0f}</td>"
+            f"<td>¥{table['inc_profit'][i]:,.0f}</td><td>{table['inc_roas'][i]:.2f}倍</td></tr>"
+            for i in range(len(names)) if i != baseline)
+        parts.append(f"<section><h2>投資対効果（対{esc(names[baseline])}）</h2><table><thead><tr><th>プラン</th>"
+                     f"<th>追加投資額/年</th><th>追加売上/年</th><th>追加利益/年</th><th>追加投資ROAS</th></tr></thead>"
+                     f"<tbody>{rows}</tbody></table></section>")
+        lines = recommend.comment(table, names, top, baseline=baseline, reference=reference, malls=result.malls)
+        parts.append('<section><h2>コンサルタントの所見</h2><div class="consul">'
+                     + "".join(f"<p>・{l}</p>" for l in lines) + "</div></section>")
+
+    charts = [f'<div class="chart">{_chart_html(fig, static, i == 0)}</div>'
+              for i, (_, fig) in enumerate(_figures(df, names, result.malls, names[reference]))]
+    parts.append(f"<section><h2>チャート</h2>{''.join(charts)}</section>")
+
+    for label, col in (("売上", "売上 (円)"), ("限界利益", "限界利益 (円)")):
+        matrix = df.pivot_table(index="プラン", columns="モール", values=col, aggfunc="sum", observed=True)
+        matrix["合計"] = matrix.sum(axis=1)
+        parts.append(f"<section><h2>プラン × モール {label}マトリクス</h2>{_yen_table(matrix)}</section>")
+
+    parts.append("<footer>シミュレーション結果は概算値です。</footer>")
+    return (f'<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8"><title>{title}</title>'
+            f"<style>{CSS}</style></head><body>{''.join(parts)}</body></html>")
+
+
+def write(job, fmt="html", out_dir=None):
+    """レポートを作成してファイルに書き出し、パスを返す（プロセスプールのワーカーで実行される）"""
+    if fmt == "pdf" and not pdf_available():
+        raise RuntimeError("PDF 出力には kaleido と weasyprint のインストールが必要です")
+    if out_dir is None:
+        out_dir = REPORT_DIR
+        _prune(out_dir)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    doc = render_html(job, static=fmt == "pdf")
+    slug = re.sub(r"[^\w-]+", "_", job.get("client") or "report").strip("_") or "report"
+    path = out_dir / f"{slug}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.{fmt}"
+    fd, tmp = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        if fmt == "pdf":
+            import weasyprint
+            f.write(weasyprint.HTML(string=doc).write_pdf())
+        else:
+            f.write(doc.encode("utf-8"))
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+    return str(path)
+
+
+def _prune(out_dir):
+    """古いレポートと書きかけの一時ファイルを消す（新しい順に MAX_REPORT_FILES 件、MAX_REPORT_AGE 秒まで残す）"""
+    cutoff = time.time() - MAX_REPORT_AGE
+    files = []
+    for f in Path(out_dir).glob("*"):
+        try:
+            files.append((f.stat().st_mtime, f))
+        except OSError:   # 他のワーカーが消した
+            pass
+    files.sort(reverse=True)
+    reports = [f for _, f in files if f.suffix[1:] in MIME]
+    for f in set(reports[MAX_REPORT_FILES:]) | {f for m, f in files if m < cutoff}:
+        try:
+            f.unlink()
+        except OSError:
+            pass
+
+
+# --- バックグラウンド実行 ---
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def submit(job, fmt="html"):
+    """レポート作成をワーカープロセスに投入し、Future（結果はファイルパス）を返す"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Streamlit サーバーはスレッドを持つため fork ではなく spawn で起動する
+            _pool = ProcessPoolExecutor(MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool.submit(write, job, fmt)
+
+
+# --- CLI ---
+def _load_jobs(path):
+    jobs = []
+    for entry in json.loads(Path(path).read_text(encoding="utf-8")):
+        jobs.append({
+            "client": entry.get("client", ""),
+            "title": entry.get("title"),
+            "params": {**defaults.DEFAULT_PARAMS, **entry.get("params", {})},
+            "plans": {k: tuple(v) for k, v in entry.get("plans", defaults.PLAN_PRESETS).items()},
+            "rules": entry.get("rules"),
+            "rank_by": entry.get("rank_by", "order"),
+            "baseline": entry.get("baseline"), "reference": entry.get("reference"),
+        })
+    return jobs
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="クライアント向けレポートの一括作成")
+    ap.add_argument("clients", help="クライアント設定の JSON ファイル")
+    ap.add_argument("--out", default="reports", help="出力ディレクトリ")
+    ap.add_argument("--format", choices=["html", "pdf"], default="html")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args(argv)
+
+    jobs = _load_jobs(args.clients)
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(write, job, args.format, args.out) for job in jobs]
+        failed = 0
+        for job, fut in zip(jobs, futures):
+            try:
+                print(f"OK    {job['client'] or '-'}: {fut.result()}")
+            except Exception as e:  # 1 件の失敗で他のクライアントを止めない
+                failed += 1
+                print(f"FAIL  {job['client'] or '-'}: {e}", file=sys.stderr)
+    print(f"{len(jobs) - failed}/{len(jobs)} 件 ({time.perf_counter() - t0:.1f}s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+シミュレーション結果の共有キャッシュ
+同じパラメータの結果をセッション間・プロセス間で 1 つだけ保持する。
+
+- プロセス内: モジュールレベルの LRU 辞書。同一パラメータのセッションは同じ SimResult を参照する（コピーしない）。
+- プロセス間: Arrow IPC ファイルとしてキャッシュディレクトリに保存し、メモリマップで読み込む。
+  数値列は OS のページキャッシュを共有するため、ワーカー数が増えても実メモリはほぼ増えない。
+
+キャッシュした結果（と to_pandas() の DataFrame）は読み取り専用として扱うこと（呼び出し側で変更しない）。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from engine import MODEL_VERSION
+from results import SimResult
+
+CACHE_DIR = Path(os.environ.get("EC_SIM_CACHE_DIR", Path(tempfile.gettempdir()) / "ec-simulator-cache"))
+MAX_MEMORY_ENTRIES = 64
+MAX_DISK_ENTRIES = 512
+FORMAT_VERSION = 2  # results.SimResult.to_arrow()
+
+_lock = threading.Lock()
+_memory = OrderedDict()
+stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def cache_key(*parts):
+    """JSON 化できるパラメータとモデルのバージョンからキャッシュキーを作る"""
+    raw = json.dumps((MODEL_VERSION, *parts), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+# --- ディスク (Arrow IPC + mmap) ---
+def _path(key):
+    # 保存形式を変えたらバージョンを上げる（旧バージョンのワーカーとファイルを共有しない）
+    return CACHE_DIR / f"{key}.v{FORMAT_VERSION}.arrow"
+
+
+def _read_disk(key):
+    try:
+        import pyarrow as pa
+        path = _path(key)
+        if not path.exists():
+            return None
+        source = pa.memory_map(str(path), "r")
+        table = pa.ipc.open_file(source).read_all()
+        result = SimResult.from_arrow(table)
+        os.utime(path)  # LRU 用に最終アクセス時刻を更新
+        return result
+    except (ImportError, OSError, ValueError, KeyError, TypeError):
+        return None  # 旧形式のファイルは計算し直して上書きする
+
+
+def _write_disk(key, result):
+    try:
+        import pyarrow as pa
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        table = result.to_arrow()
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f, pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp, _path(key))  # 他プロセスから書きかけのファイルが見えないようにする
+        _prune_disk()
+    except (ImportError, OSError, ValueError):
+        pass
+
+
+def _prune_disk():
+    files = sorted(CACHE_DIR.glob("*.arrow"), key=lambda f: f.stat().st_mtime, reverse=True)
+    for f in files[MAX_DISK_ENTRIES:]:
+        try:
+            f.unlink()
+        except OSError:
+            pass
+
+
+# --- 公開 API ---
+def get_or_compute(key, compute):
+    """key の結果をメモリ → ディスク → compute() の順に探して返す"""
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            stats["memory_hits"] += 1
+            return _memory[key]
+
+    result = _read_disk(key)
+    if result is not None:
+        stats["disk_hits"] += 1
+    else:
+        stats["misses"] += 1
+        result = compute()
+        _write_disk(key, result)
+
+    with _lock:
+        # 並行して同じキーを計算したセッションがあれば、先に登録された方を共有する
+        result = _memory.setdefault(key, result)
+        _memory.move_to_end(key)
+        while len(_memory) > MAX_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+    return result
+
+
+def clear():
+    with _lock:
+        _memory.clear()
@@ -0,0 +1,104 @@
+"""
+シミュレーション結果のコンテナ
+行（プラン → 月 → モールの順）ごとに持つのは整数コード化した次元と金額・件数の列だけで、
+次元の組み合わせで決まる値（CVR・季節指数・手数料率）は小さな配列として 1 回だけ持つ。
+
+- to_pandas(): プラン・月・モールを Categorical にした DataFrame（計測列はコピーしない）
+- to_arrow() / from_arrow(): 次元を辞書型にした Arrow テーブル。属性はスキーマのメタデータに入れる
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+MONTH_LABELS = ["1月","2月","3月","4月","5月","6月","7月","8月","9月","10月","11月","12月"]
+_META_KEY = b"ec-simulator"
+
+
+class SimResult:
+    """plans × 12ヶ月 × malls のシミュレーション結果
+
+    measures: {列名: (行数,) の int64 配列}
+    cvr: (P, M) / seasonality: (P, 12) / fee_rate: (M, 12)
+    """
+
+    def __init__(self, plans, malls, measures, cvr, seasonality, fee_rate, codes=None):
+        self.plans = list(plans)
+        self.malls = list(malls)
+        self.measures = measures
+        self.cvr = np.asarray(cvr, dtype=float)
+        self.seasonality = np.asarray(seasonality, dtype=float)
+        self.fee_rate = np.asarray(fee_rate, dtype=float)
+        if codes is None:
+            P, M = len(self.plans), len(self.malls)
+            codes = {
+                "plan": np.repeat(np.arange(P, dtype=np.int16), 12 * M),
+                "month": np.tile(np.repeat(np.arange(12, dtype=np.int8), M), P),
+                "mall": np.tile(np.arange(M, dtype=np.int8), 12 * P),
+            }
+        self.codes = codes
+        self._frame = None
+
+    def __len__(self):
+        return len(self.codes["plan"])
+
+    @property
+    def nbytes(self):
+        arrays = [*self.codes.values(), *self.measures.values(), self.cvr, self.seasonality, self.fee_rate]
+        return sum(a.nbytes for a in arrays)
+
+    def plan_totals(self, columns):
+        """プランごとの年間合計 {列名: (P,) 配列}
+
+        行はプラン → 月 → モールの順に並んでいるので reshape して足すだけ（プラン数によらず 1 パス）。
+        """
+        P = len(self.plans)
+        return {c: self.measures[c].reshape(P, -1).sum(axis=1) for c in columns}
+
+    def to_pandas(self):
+        """表示・集計用の DataFrame（一度作ったものを共有する。読み取り専用として扱うこと）"""
+        if self._frame is None:
+            p, t, m = self.codes["plan"], self.codes["month"], self.codes["mall"]
+            cols = {
+                "プラン": pd.Categorical.from_codes(p, self.plans),
+                "月": pd.Categorical.from_codes(t, MONTH_LABELS, ordered=True),
+                "月番号": t + np.int8(1),
+                "モール": pd.Categorical.from_codes(m, self.malls),
+                "季節指数": self.seasonality.astype(np.float32)[p, t],
+            }
+            for name, values in self.measures.items():
+                cols[name] = values
+                if name == "アクセス数":
+                    cols["CVR"] = self.cvr.astype(np.float32)[p, m]
+            # 列の並びは従来の DataFrame と同じ（手数料率は計測列の後）
+            order = list(cols)
+            order.insert(order.index("限界利益 (円)") + 1, "手数料率")
+            cols["手数料率"] = self.fee_rate.astype(np.float32)[m, t]
+            self._frame = pd.DataFrame({k: cols[k] for k in order}, copy=False)
+        return self._frame
+
+    def to_arrow(self):
+        import pyarrow as pa
+
+        arrays = {
+            "プラン": pa.DictionaryArray.from_arrays(self.codes["plan"], self.plans),
+            "月": pa.DictionaryArray.from_arrays(self.codes["month"], MONTH_LABELS),
+            "モール": pa.DictionaryArray.from_arrays(self.codes["mall"], self.malls),
+            **{k: pa.array(v) for k, v in self.measures.items()},
+        }
+        meta = {"cvr": self.cvr.tolist(), "seasonality": self.seasonality.tolist(),
+                "fee_rate": self.fee_rate.tolist()}
+        return pa.table(arrays).replace_schema_metadata({_META_KEY: json.dumps(meta)})
+
+    @classmethod
+    def from_arrow(cls, table):
+        """to_arrow() の逆変換。メモリマップしたテーブルでも計測列はコピーしない"""
+        meta = json.loads(table.schema.metadata[_META_KEY])
+        dims = {}
+        for key, col in (("plan", "プラン"), ("month", "月"), ("mall", "モール")):
+            arr = table.column(col).combine_chunks()
+            dims[key] = (arr.indices.to_numpy(), arr.dictionary.to_pylist())
+        measures = {name: table.column(name).combine_chunks().to_numpy()
+                    for name in table.column_names if name not in ("プラン", "月", "モール")}
+        return cls(dims["plan"][1], dims["mall"][1], measures, meta["cvr"], meta["seasonality"],
+                   meta["fee_rate"], codes={k: v[0] for k, v in dims.items()})
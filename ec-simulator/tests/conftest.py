@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# アプリのモジュール（engine, results など）はパッケージ化していないため、ディレクトリを直接参照する
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
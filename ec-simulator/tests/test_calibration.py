@@ -0,0 +1,49 @@
+"""
+キャリブレーション (calibration.fit) の推定値の確認
+エンジンで作った 3 モール分の実績（月・モールごとに広告費が違う）から、既知の CPC と自然流入数を戻せること、
+推定に足りない実績では ValueError になることを確認する。
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import calibration
+import defaults
+import engine
+
+MALLS = ["Amazon", "楽天市場", "Yahoo!"]
+TRUTH = {"base_cvr": 0.025, "target_cpc": 80.0, "organic_traffic_base": 40_000.0,
+         "seasonality": [1.1, 0.7, 1.3, 0.9, 1.0, 1.2, 1.4, 0.8, 1.1, 0.9, 1.0, 0.6]}   # 平均 1.0
+
+
+def synthetic_actuals(years=2, seed=0):
+    """TRUTH のエンジン出力をモール列付きの月次 CSV（バイト列）にする"""
+    rng = np.random.default_rng(seed)
+    ad = rng.uniform(100_000, 900_000, (years, len(MALLS), 12))
+    params = {**defaults.DEFAULT_PARAMS, **TRUTH, "active_malls": MALLS}
+    a = engine.simulate_arrays({**params, "ad_budget_monthly": ad}, {y: (1.0, 1.0, 1.0) for y in range(years)})
+    rows = [{"年月": f"{2022 + y}-{t + 1:02d}", "モール": mall, "売上 (円)": a["sales"][y, m, t],
+             "アクセス数": a["traffic"][y, m, t], "広告費 (円)": ad[y, m, t]}
+            for y in range(years) for m, mall in enumerate(MALLS) for t in range(12)]
+    return pd.DataFrame(rows).to_csv(index=False).encode("utf-8")
+
+
+def test_fit_recovers_cpc_and_organic_traffic():
+    actuals = calibration.load_actuals([synthetic_actuals()])
+    res = calibration.fit(actuals, {**defaults.DEFAULT_PARAMS, "active_malls": MALLS})
+    fitted = res["params"]
+    assert fitted["target_cpc"] == pytest.approx(TRUTH["target_cpc"], rel=1e-3)
+    assert fitted["organic_traffic_base"] == pytest.approx(TRUTH["organic_traffic_base"], rel=1e-3)
+    assert fitted["base_cvr"] == pytest.approx(TRUTH["base_cvr"], rel=1e-3)
+    np.testing.assert_allclose(fitted["seasonality"], TRUTH["seasonality"], rtol=1e-3)
+    assert res["r2"] > 0.999
+
+
+@pytest.mark.parametrize("csv", [
+    "年月,モール,売上 (円),アクセス数\n" + "".join(f"2023-{t:02d},Amazon,0,1000\n" for t in range(1, 13)),
+    "年月,モール,売上 (円),アクセス数,広告費 (円)\n2023-05,Amazon,1200000,9000,300000\n",
+], ids=["no_sales", "one_month"])
+def test_fit_rejects_insufficient_actuals(csv):
+    actuals = calibration.load_actuals([csv.encode("utf-8")])
+    with pytest.raises(ValueError):
+        calibration.fit(actuals, dict(defaults.DEFAULT_PARAMS))
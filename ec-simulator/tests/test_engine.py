@@ -0,0 +1,125 @@
+"""
+ベクトル化エンジン (engine.simulate) と旧 app.py の run_sim（モール × 月の Python ループ）の突き合わせ
+ランダムなサイドバー入力で、to_pandas() の DataFrame が旧実装の DataFrame と一致することを確認する。
+"""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+
+MONTH_LABELS = ["1月","2月","3月","4月","5月","6月","7月","8月","9月","10月","11月","12月"]
+ORIGINAL_MALLS = ["Amazon", "楽天市場", "Yahoo!"]
+INT_COLUMNS = ["月番号", "アクセス数", "売上 (円)", "原価 (円)", "モール手数料 (円)", "広告費 (円)", "限界利益 (円)"]
+
+
+def legacy_run_sim(p, plan_name, ad_mult, cvr_mult, trf_mult):
+    """リファクタリング前の app.py の run_sim（サイドバー変数を params 参照に置き換えただけ）"""
+    records = []
+    plan_ad = p["ad_budget_monthly"] * ad_mult
+    plan_organic = p["organic_traffic_base"] * trf_mult
+    plan_cvr_base = p["base_cvr"] * cvr_mult
+    ad_traffic = (plan_ad / p["target_cpc"]) if p["target_cpc"] > 0 else 0
+
+    for m_idx in range(12):
+        mn = m_idx + 1
+        si = p["seasonality"][m_idx]
+        organic = plan_organic * si
+        base_traffic = organic + ad_traffic
+
+        for mall in p["active_malls"]:
+            traffic = base_traffic
+            if mall == "Amazon" and mn == 7: traffic *= p["prime_day_boost"]
+            elif mall == "楽天市場" and mn in (3,6,9,12): traffic *= p["ss_boost"]
+            elif mall == "Yahoo!": traffic *= p["five_day_boost"]
+
+            cvr = plan_cvr_base * (1 + p["point_mult"] * 0.01) * (1 + p["fba_usage"] * 0.1)
+            bb = p["buy_box_pct"] if mall == "Amazon" else 1.0
+            sales = traffic * cvr * p["average_order_value"] * bb
+            cogs = sales * p["cogs_rate"]
+            if mall == "Amazon": fr = 0.10
+            elif mall == "楽天市場": fr = 0.06
+            else: fr = 0.03 + p["pr_option_rate"]
+            fee = sales * fr
+            profit = sales - cogs - fee - plan_ad
+
+            records.append({
+                "プラン": plan_name, "月": MONTH_LABELS[m_idx], "月番号": mn,
+                "モール": mall, "季節指数": si,
+                "アクセス数": int(round(traffic)), "CVR": round(cvr, 4),
+                "売上 (円)": round(sales), "原価 (円)": round(cogs),
+                "モール手数料 (円)": round(fee), "広告費 (円)": round(plan_ad),
+                "限界利益 (円)": round(profit), "手数料率": fr,
+            })
+    return records
+
+
+def random_case(rng):
+    """サイドバーの入力範囲からランダムにパラメータとプランを作る"""
+    params = {
+        "active_malls": [m for m in ORIGINAL_MALLS if rng.random() < 0.7] or [rng.choice(ORIGINAL_MALLS)],
+        "seasonality": [round(rng.uniform(0.1, 5.0), 2) for _ in range(12)],
+        "ad_budget_monthly": rng.randrange(0, 5_000_001, 50_000),
+        "target_cpc": rng.randrange(1, 500, 5),
+        "organic_traffic_base": rng.randrange(0, 200_001, 1_000),
+        "base_cvr": round(rng.uniform(0.001, 0.10), 3),
+        "average_order_value": rng.randrange(100, 50_001, 100),
+        "cogs_rate": round(rng.uniform(0.0, 1.0), 2),
+        "buy_box_pct": round(rng.uniform(0.0, 1.0), 2),
+        "fba_usage": round(rng.uniform(0.0, 1.0), 2),
+        "prime_day_boost": round(rng.uniform(1.0, 5.0), 1),
+        "ss_boost": round(rng.uniform(1.0, 5.0), 1),
+        "point_mult": round(rng.uniform(1.0, 10.0) * 2) / 2,
+        "five_day_boost": round(rng.uniform(1.0, 3.0), 1),
+        "pr_option_rate": round(rng.uniform(0.0, 0.30), 2),
+        "cohort": None, "inventory": None,
+    }
+    if rng.random() < 0.3:
+        plans = {"単一プラン": (1.0, 1.0, 1.0)}
+    else:
+        plans = {name: (round(rng.uniform(0.1, 5.0), 1), round(rng.uniform(0.8, 2.0) * 20) / 20,
+                        round(rng.uniform(0.8, 3.0) * 20) / 20)
+                 for name in ("🥈 シルバー", "🥇 ゴールド", "💎 プラチナ")}
+    return params, plans
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_simulate_matches_legacy_run_sim(seed):
+    params, plans = random_case(random.Random(seed))
+    expected = pd.DataFrame([r for name, cfg in plans.items() for r in legacy_run_sim(params, name, *cfg)])
+    result = engine.simulate(params, plans)
+    actual = result.to_pandas()
+
+    assert list(actual.columns) == list(expected.columns)
+    for col in ("プラン", "月", "モール"):
+        assert actual[col].astype(str).tolist() == expected[col].tolist()
+    for col in INT_COLUMNS:
+        assert actual[col].astype(np.int64).tolist() == expected[col].tolist(), col
+    # 表示用の列は float32 で持つので相対誤差で比べる
+    for col in ("季節指数", "CVR", "手数料率"):
+        np.testing.assert_allclose(actual[col].to_numpy(np.float64), expected[col].to_numpy(), rtol=1e-6)
+    # 丸めた CVR そのもの（float64）は旧実装と完全に一致する
+    cvr = result.cvr[result.codes["plan"], result.codes["mall"]]
+    assert cvr.tolist() == expected["CVR"].tolist()
+
+
+def test_row_positions_match_filter():
+    params, plans = random_case(random.Random(0))
+    params["active_malls"] = ORIGINAL_MALLS
+    plans = {"a": (1.0, 1.0, 1.0), "b": (2.0, 1.1, 1.2)}
+    df = engine.simulate(params, plans).to_pandas()
+    rows = engine.row_positions(list(plans), ORIGINAL_MALLS, plan="b", mall="楽天市場")
+    expected = np.flatnonzero((df["プラン"] == "b") & (df["モール"] == "楽天市場"))
+    assert rows.tolist() == expected.tolist()
+
+
+def test_cvr_rounding_matches_python_round():
+    # 0.1 × 1.25 × 1.01 × 1.08 = 0.13635 は np.round(…, 4) だと 0.1363、旧実装の round では 0.1364
+    params, _ = random_case(random.Random(0))
+    params.update(base_cvr=0.1, point_mult=1.0, fba_usage=0.8)
+    plans = {"p": (1.0, 1.25, 1.0)}
+    expected = legacy_run_sim(params, "p", *plans["p"])
+    result = engine.simulate(params, plans)
+    assert result.cvr[0].tolist() == [r["CVR"] for r in expected[:len(params["active_malls"])]]
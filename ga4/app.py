@@ -1,10 +1,7 @@
 import streamlit as st
-import google.generativeai as genai
-import pandas as pd
 import random
-import time
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # --- 1. 固定パスワード設定 (本番環境ではsecrets管理を推奨) ---
 FIXED_PASSWORD = "password123"  # 閲覧用パスワード
@@ -35,6 +32,11 @@ def check_password():
 if not check_password():
     st.stop()  # 認証未完了ならここで停止
 
+# --- 重いモジュールは認証通過後に読み込む (ログイン画面のコールドスタートを軽くする) ---
+import pandas as pd
+import signals
+import payload
+
 # ==========================================
 # メインアプリケーション (認証通過後に表示)
 # ==========================================
@@ -50,18 +52,24 @@ model_name = st.sidebar.selectbox("Model", ["gemini-2.0-flash", "gemini-1.5-pro"
 # 期間設定
 period = st.sidebar.selectbox("Period", ["Daily", "Weekly", "Monthly"])
 
+# AIに送るデータ量（古い期間はトークン予算に収まるよう自動で集約）
+st.sidebar.subheader("🧮 AI Context")
+context_days = st.sidebar.slider("Context Window (days)", 7, 90, 90)
+token_budget = st.sidebar.number_input("Token Budget", min_value=200, value=payload.DEFAULT_BUDGET, step=100)
+
 # --- Mock Data Generation ---
 @st.cache_data(ttl=3600)
 def fetch_mock_data():
     """時系列サマリと人気ページランキングを生成"""
     # 1. 時系列データ
-    dates = pd.date_range(end=datetime.today(), periods=30).strftime("%Y-%m-%d").tolist()
+    n_days = 90
+    dates = pd.date_range(end=datetime.today(), periods=n_days).strftime("%Y-%m-%d").tolist()
     ts_data = {
         "date": dates,
-        "users": [100 + i*5 + random.randint(-20, 50) for i in range(30)],
-        "sessions": [120 + i*6 + random.randint(-10, 60) for i in range(30)],
-        "revenue": [i * 150 + random.randint(0, 500) for i in range(30)],
-        "engagement_rate": [0.55 + (i*0.003) for i in range(30)]
+        "users": [100 + i*5 + random.randint(-20, 50) for i in range(n_days)],
+        "sessions": [120 + i*6 + random.randint(-10, 60) for i in range(n_days)],
+        "revenue": [i * 150 + random.randint(0, 500) for i in range(n_days)],
+        "engagement_rate": [0.55 + (i*0.003) for i in range(n_days)]
     }
     
     # 2. ページランキングデータ
@@ -94,6 +102,7 @@ def run_ai_analysis(api_key, model, data_summary):
         return {"error": "API Key is missing. Please enter it in the sidebar."}
     
     try:
+        import google.generativeai as genai  # 初回の分析実行時にのみ読み込む
         genai.configure(api_key=api_key)
         gemini = genai.GenerativeModel(
             model_name=model,
@@ -102,6 +111,7 @@ def run_ai_analysis(api_key, model, data_summary):
         
         prompt = f"""
         あなたはWebコンサルタントチームです。以下のWebサイトデータを分析し、UI、SEO、Analystの3つの視点で評価してください。
+        データは事前の統計処理結果です（latest: 直近値, wow_change_pct: 前週比%, anomalies: 異常検知された日と期待値・zスコア, forecast: 今後7日の予測値と標準偏差, history/recent: 過去期間（集約）と直近の日次データ。CSV形式、'#'行は全行共通の値）。
         
         データ: {data_summary}
         
@@ -120,7 +130,14 @@ def run_ai_analysis(api_key, model, data_summary):
         """
         
         response = gemini.generate_content(prompt)
-        return json.loads(response.text)
+        result = json.loads(response.text)
+        usage = getattr(response, "usage_metadata", None)
+        result["_tokens"] = {
+            "estimated": payload.estimate_tokens(prompt),
+            "prompt": getattr(usage, "prompt_token_count", None),
+            "output": getattr(usage, "candidates_token_count", None),
+        }
+        return result
         
     except Exception as e:
         return {"error": str(e)}
@@ -160,15 +177,23 @@ with tab1:
 with tab2:
     st.header("Multi-Agent Analysis")
     st.write("Gemini APIを使って、UI/SEO/分析の3視点からサイトを診断します。")
+
+    # ローカル統計（異常検知・予測）+ 直近データを予算内のコンパクトなテーブルに圧縮
+    window_ts = df_ts.tail(context_days)
+    summary_text, payload_stats = payload.encode(
+        window_ts, signals.summarize(window_ts), days=context_days, budget=token_budget)
+    st.caption(
+        f"送信データ: {payload_stats['days']}日分 ／ 推定 {payload_stats['tokens']:,} tokens "
+        f"(予算 {payload_stats['budget']:,}) ／ 過去期間: {payload_stats['history_granularity']}")
+    with st.expander("📦 送信ペイロードを確認"):
+        st.code(summary_text, language="text")
     
     if st.button("Start AI Analysis"):
         if not user_api_key:
             st.error("⚠️ サイドバーにGemini API Keyを入力してください。")
         else:
             with st.spinner("AI Agents are discussing..."):
-                # データ量削減のため直近7日分のみ送信
-                summary_json = df_ts.tail(7).to_json(orient="records")
-                result = run_ai_analysis(user_api_key, model_name, summary_json)
+                result = run_ai_analysis(user_api_key, model_name, summary_text)
                 
                 if "error" in result:
                     st.error(f"Analysis Failed: {result['error']}")
@@ -180,4 +205,9 @@ with tab2:
                     r3.success(f"📈 Analyst: {result['agents']['analyst']}")
                     
                     st.subheader("Cross-Evaluation Matrix")
-                    st.dataframe(pd.DataFrame(result["matrix"]))
\ No newline at end of file
+                    st.dataframe(pd.DataFrame(result["matrix"]))
+
+                    tokens = result.get("_tokens", {})
+                    st.caption(
+                        f"Tokens — 推定: {tokens.get('estimated')} ／ "
+                        f"実測 prompt: {tokens.get('prompt')} ／ output: {tokens.get('output')}")
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+AI コンサルタント向けプロンプトペイロードのエンコーダ
+records 形式の JSON（行ごとにキーが繰り返される）の代わりに、丸め済みの CSV 風テーブルを送る。
+トークン予算を超える場合は古い期間から週次・月次へ集約して圧縮する。
+"""
+import pandas as pd
+
+DEFAULT_BUDGET = 2000
+GRANULARITIES = (("W", "週次"), ("M", "月次"))
+
+
+# --- トークン見積り ---
+def estimate_tokens(text):
+    """概算トークン数（ASCII は約 4 文字 / トークン、日本語などの非 ASCII は 1 文字 / トークン）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+# --- テーブル整形 ---
+def _fmt(value, decimals):
+    if isinstance(value, float):
+        value = round(value, decimals)
+        return str(int(value)) if value == int(value) else f"{value:.{decimals}f}".rstrip("0")
+    return str(value)
+
+
+def compact_table(df, decimals=2, name=None):
+    """DataFrame を CSV 風テキストに変換する
+
+    全行で同じ値の列はヘッダー行に 1 度だけ書き出し、数値は decimals 桁に丸める。
+    """
+    lines = [f"## {name}"] if name else []
+    if df.empty:
+        return "\n".join(lines + ["(none)"])
+    const = [c for c in df.columns if len(df) > 1 and df[c].nunique(dropna=False) == 1]
+    if const:
+        lines.append("# " + ", ".join(f"{c}={_fmt(df[c].iloc[0], decimals)}" for c in const))
+    body = df.drop(columns=const)
+    lines.append(",".join(body.columns))
+    for row in body.itertuples(index=False):
+        lines.append(",".join(_fmt(v, decimals) for v in row))
+    return "\n".join(lines)
+
+
+def _aggregate(df, freq, date_col):
+    """期間ごとに集約する（date は期間の開始日）。*_rate 列は平均、それ以外の数値列は合計"""
+    start = pd.to_datetime(df[date_col]).dt.to_period(freq).dt.start_time.dt.strftime("%Y-%m-%d")
+    agg = {c: ("mean" if c.endswith("_rate") else "sum")
+           for c in df.columns if c != date_col and pd.api.types.is_numeric_dtype(df[c])}
+    out = df.groupby(start.rename(date_col), sort=True).agg(agg)
+    # 端の期間は日数が欠けるため、集約日数を併記する
+    out.insert(0, "days", start.value_counts().reindex(out.index).to_numpy())
+    return out.reset_index()
+
+
+# --- ペイロード生成 ---
+def _encode_signals(summary, decimals):
+    parts = []
+    period = summary.get("period") or {}
+    if period:
+        parts.append(f"period: {period['start']}..{period['end']} ({period['days']}d)")
+    for key in ("latest", "wow_change_pct"):
+        if summary.get(key):
+            parts.append(f"{key}: " + ", ".join(f"{k}={_fmt(v, decimals)}" for k, v in summary[key].items()))
+    parts.append(compact_table(pd.DataFrame(summary.get("anomalies", [])), decimals, "anomalies"))
+    fc = summary.get("forecast") or {}
+    if fc.get("dates"):
+        table = pd.DataFrame({k: v for k, v in fc.items() if isinstance(v, list)})
+        parts.append(compact_table(table, 1, "forecast"))
+        if fc.get("std"):
+            parts.append("forecast_std: " + ", ".join(f"{k}={_fmt(v, 1)}" for k, v in fc["std"].items()))
+    return "\n".join(parts)
+
+
+def _shrink_signals(summary):
+    """シグナルを 1 段階削る（スコアの低い異常 → 遠い予測日の順）。これ以上削れなければ None"""
+    if summary.get("anomalies"):
+        return {**summary, "anomalies": summary["anomalies"][:-1]}
+    fc = summary.get("forecast") or {}
+    if len(fc.get("dates") or []) > 1:
+        return {**summary, "forecast": {k: v[:-1] if isinstance(v, list) else v for k, v in fc.items()}}
+    return None
+
+
+def encode(df, summary=None, days=90, recent_days=14, budget=DEFAULT_BUDGET, date_col="date", decimals=2):
+    """直近 days 日分を予算内のテキストに圧縮する → (テキスト, 統計情報)
+
+    直近 recent_days 日は日次のまま残し、それより古い期間は予算に収まるまで
+    週次 → 月次 → 古い順に削除、の順で圧縮する。過去期間をすべて削っても収まらない場合は、
+    スコアの低い異常・遠い予測日・直近日次の古い日の順に削る（見出しだけは残す）。
+    """
+    window = df.tail(days)
+    recent = window.tail(recent_days)
+    older = window.iloc[:len(window) - len(recent)]
+
+    def render(older_table, label, recent_table, signals):
+        sections = [_encode_signals(signals, decimals)] if signals else []
+        if older_table is not None and not older_table.empty:
+            sections.append(compact_table(older_table, decimals, f"history ({label})"))
+        sections.append(compact_table(recent_table, decimals, "recent (日次)"))
+        return "\n".join(sections)
+
+    candidates = [(older, "日次")]
+    if not older.empty:
+        candidates += [(_aggregate(older, freq, date_col), label) for freq, label in GRANULARITIES]
+    text, granularity, kept = "", "日次", older
+    for table, label in candidates:
+        text, granularity, kept = render(table, label, recent, summary), label, table
+        if estimate_tokens(text) <= budget:
+            break
+    else:
+        # 月次でも収まらない場合は古い期間から切り捨てる
+        while len(kept) and estimate_tokens(text) > budget:
+            kept = kept.iloc[1:]
+            text = render(kept, granularity, recent, summary)
+
+    # 最後の手段: シグナルの行と直近日次を削る
+    signals = summary
+    while estimate_tokens(text) > budget:
+        shrunk = _shrink_signals(signals) if signals else None
+        if shrunk is not None:
+            signals = shrunk
+        elif len(recent) > 1:
+            recent = recent.iloc[1:]
+        else:
+            break
+        text = render(kept, granularity, recent, signals)
+
+    return text, {
+        "tokens": estimate_tokens(text),
+        "budget": budget,
+        "days": len(window),
+        "history_granularity": granularity if len(kept) else "なし",
+        "history_rows": len(kept),
+        "recent_rows": len(recent),
+        "chars": len(text),
+    }
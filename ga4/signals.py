@@ -0,0 +1,161 @@
+"""
+GA4 時系列のローカル統計パス
+LLM 呼び出しの前に異常検知（ローリング z スコア / 簡易 STL 分解）と短期予測を行い、
+生データの代わりにプロンプトへ渡す要約を作る。
+
+計算はすべて (系列数 × 日数) の 2 次元配列で行うため、
+複数プロパティ × 複数指標を 1 回の呼び出しでまとめて処理できる。
+"""
+import numpy as np
+
+DEFAULT_METRICS = ("users", "sessions", "revenue")
+
+
+def _as_2d(values):
+    arr = np.asarray(values, dtype=float)
+    return arr[np.newaxis, :] if arr.ndim == 1 else arr
+
+
+def _window_sums(x, window):
+    """各時点 t について x[:, t-window:t] の合計を返す (t = window..n-1)"""
+    c = np.cumsum(np.pad(x, ((0, 0), (1, 0))), axis=1)
+    n = x.shape[1]
+    return c[:, window:n] - c[:, :n - window]
+
+
+# --- 異常検知 ---
+def rolling_zscore(values, window=7):
+    """直前 window 日の平均・標準偏差に対する z スコア（先頭 window 日は NaN）"""
+    x = _as_2d(values)
+    z = np.full(x.shape, np.nan)
+    if x.shape[1] <= window:
+        return z
+    # 桁落ちを避けるため系列平均で中心化してから累積和を取る
+    xc = x - x.mean(axis=1, keepdims=True)
+    mean = _window_sums(xc, window) / window
+    var = np.maximum(_window_sums(xc * xc, window) / window - mean ** 2, 0.0)
+    std = np.sqrt(var)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z[:, window:] = np.where(std > 0, (xc[:, window:] - mean) / std, 0.0)
+    return z
+
+
+def decompose(values, period=7):
+    """移動中央値トレンド + 周期別中央値の季節成分による簡易 STL 分解 → (trend, seasonal, resid)"""
+    x = _as_2d(values)
+    s, n = x.shape
+    width = period if period % 2 == 1 else period + 1
+    half = width // 2
+    # 奇反転で端を延長し、線形トレンドが端で歪まないようにする。
+    # 外れ値に引きずられないよう、トレンドは移動中央値で取る
+    padded = np.pad(x, ((0, 0), (half, half)), mode="reflect", reflect_type="odd")
+    trend = np.median(np.lib.stride_tricks.sliding_window_view(padded, width, axis=1), axis=-1)
+
+    detrended = x - trend
+    cycles = -(-n // period)
+    grid = np.full((s, cycles * period), np.nan)
+    grid[:, :n] = detrended
+    profile = np.nanmedian(grid.reshape(s, cycles, period), axis=1)
+    profile -= profile.mean(axis=1, keepdims=True)
+    seasonal = np.tile(profile, cycles)[:, :n]
+    return trend, seasonal, x - trend - seasonal
+
+
+def robust_zscore(resid, level=None, rel_floor=0.01):
+    """中央値と MAD による頑健 z スコア
+
+    ノイズがほぼ無い系列で z が発散しないよう、MAD の下限を level（系列の代表値）の rel_floor 倍とする。
+    """
+    r = _as_2d(resid)
+    med = np.median(r, axis=1, keepdims=True)
+    mad = np.median(np.abs(r - med), axis=1, keepdims=True)
+    if level is not None:
+        mad = np.maximum(mad, rel_floor * np.abs(_as_2d(level)).mean(axis=1, keepdims=True))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(mad > 0, 0.6745 * (r - med) / mad, 0.0)
+
+
+# --- 予測 ---
+def forecast(values, horizon=7, period=7):
+    """線形トレンド + 周期ダミーの最小二乗予測 → (予測値, 残差標準偏差)
+
+    説明変数行列は全系列で共通なので、全系列を 1 回の lstsq で解く。
+    """
+    x = _as_2d(values)
+    n = x.shape[1]
+    t = np.arange(n + horizon, dtype=float)
+    cols = [np.ones_like(t), t]
+    if n >= period * 2:
+        cols += [(np.arange(n + horizon) % period == k).astype(float) for k in range(1, period)]
+    design = np.column_stack(cols)
+    coef, *_ = np.linalg.lstsq(design[:n], x.T, rcond=None)
+    fitted = (design @ coef).T
+    dof = max(n - design.shape[1], 1)
+    resid_std = np.sqrt(((x - fitted[:, :n]) ** 2).sum(axis=1) / dof)
+    return fitted[:, n:], resid_std
+
+
+# --- 一括分析 ---
+def analyze(matrix, window=14, period=7, horizon=7, z_threshold=3.0):
+    """(系列数 × 日数) の配列を一括分析し、異常フラグ・スコア・予測を返す
+
+    異常はローリング z と STL 残差 z の両方が閾値を超えた点（ローリング窓が埋まらない
+    先頭区間は STL 側のみで判定）。予測は異常点を期待値で置き換えた系列に対して行う。
+    """
+    x = _as_2d(matrix)
+    roll_z = rolling_zscore(x, window)
+    trend, seasonal, resid = decompose(x, period)
+    stl_z = robust_zscore(resid, level=x)
+    stl_hit = np.abs(stl_z) >= z_threshold
+    flags = np.where(np.isnan(roll_z), stl_hit, stl_hit & (np.abs(np.nan_to_num(roll_z)) >= z_threshold))
+    expected = trend + seasonal
+    pred, pred_std = forecast(np.where(flags, expected, x), horizon, period)
+    return {
+        "flags": flags,
+        "roll_z": roll_z,
+        "stl_z": stl_z,
+        "expected": expected,
+        "forecast": pred,
+        "forecast_std": pred_std,
+    }
+
+
+def summarize(df, metrics=DEFAULT_METRICS, date_col="date", horizon=7, max_anomalies=10, **kwargs):
+    """df_ts から LLM に渡す要約（直近値・前週比・異常・予測）を作る"""
+    metrics = [m for m in metrics if m in df.columns]
+    dates = df[date_col].astype(str).tolist()
+    x = df[metrics].to_numpy(dtype=float).T
+    res = analyze(x, horizon=horizon, **kwargs)
+
+    # 異常スコアは |roll_z| と |stl_z| の大きい方。上位 max_anomalies 件だけを辞書化する
+    roll = np.nan_to_num(res["roll_z"])
+    score = np.where(np.abs(roll) > np.abs(res["stl_z"]), roll, res["stl_z"])
+    rows, cols = np.nonzero(res["flags"])
+    top = np.argsort(-np.abs(score[rows, cols]), kind="stable")[:max_anomalies]
+    anomalies = [{
+        "date": dates[d],
+        "metric": metrics[i],
+        "value": round(float(x[i, d]), 2),
+        "expected": round(float(res["expected"][i, d]), 2),
+        "z": round(float(score[i, d]), 2),
+    } for i, d in zip(rows[top], cols[top])]
+
+    n = x.shape[1]
+    recent = x[:, -7:].sum(axis=1)
+    prior = x[:, -14:-7].sum(axis=1) if n >= 14 else np.zeros(len(metrics))
+    future = (np.datetime64(dates[-1], "D") + np.arange(1, horizon + 1)).astype(str).tolist() if dates else []
+
+    return {
+        "period": {"start": dates[0], "end": dates[-1], "days": n} if dates else {},
+        "latest": {m: round(float(x[i, -1]), 4) for i, m in enumerate(metrics)},
+        "wow_change_pct": {
+            m: round(float((recent[i] - prior[i]) / prior[i] * 100), 1) if prior[i] else None
+            for i, m in enumerate(metrics)
+        },
+        "anomalies": anomalies,
+        "forecast": {
+            "dates": future,
+            **{m: [round(float(v), 1) for v in res["forecast"][i]] for i, m in enumerate(metrics)},
+            "std": {m: round(float(res["forecast_std"][i]), 1) for i, m in enumerate(metrics)},
+        },
+    }
@@ -0,0 +1,106 @@
+"""
+Streamlit アプリの起動時インポート時間チェック
+
+各 app.py のうち「最初の描画より前」に実行されるトップレベル import（クリティカルパス）を
+`python -X importtime` で新しいプロセスごとに計測し、予算を超えていれば終了コード 1 を返す。
+遅延読み込みしている import（関数内・描画後のトップレベル）は参考値として表示する。
+
+使い方:
+    python tools/import_budget.py                 # 両アプリを既定の予算でチェック
+    python tools/import_budget.py --budget-ms 600 # 予算を上書き
+"""
+import argparse
+import ast
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# アプリごとのクリティカルパス予算 (ms)
+APPS = {
+    "ec-simulator": 1000,
+    "ga4": 1000,
+}
+
+
+def _module_names(node):
+    if isinstance(node, ast.Import):
+        return [a.name for a in node.names]
+    if isinstance(node, ast.ImportFrom) and node.level == 0:
+        return [node.module]
+    return []
+
+
+def _is_first_paint(node):
+    """set_page_config 以外の st.* 呼び出し、または if / with ブロックを最初の描画とみなす"""
+    if isinstance(node, (ast.If, ast.With)):
+        return True
+    if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
+        func = node.value.func
+        return (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)
+                and func.value.id == "st" and func.attr != "set_page_config")
+    return False
+
+
+def split_imports(path):
+    """app.py の import を (クリティカルパス, 遅延) に分ける"""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    critical, deferred, painted = [], [], False
+    for node in tree.body:
+        painted = painted or _is_first_paint(node)
+        (deferred if painted else critical).extend(_module_names(node))
+    for node in ast.walk(tree):
+        if node in tree.body:
+            continue
+        deferred.extend(_module_names(node))
+    deferred = [m for m in dict.fromkeys(deferred) if m not in critical]
+    return critical, deferred
+
+
+def measure(modules, cwd):
+    """新しいプロセスで modules を順に import し、トップレベルの累積時間 (ms) を返す"""
+    if not modules:
+        return 0.0
+    code = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=cwd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 先頭に空白のない行がトップレベル（= この import 文が直接読み込んだもの）
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            total_us += int(cumulative)
+    return total_us / 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("apps", nargs="*", default=list(APPS), help="チェックするアプリ (ディレクトリ名)")
+    parser.add_argument("--budget-ms", type=float, help="全アプリ共通の予算 (ms)")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for app in args.apps:
+        app_dir = ROOT / app
+        budget = args.budget_ms or APPS.get(app, 1000)
+        critical, deferred = split_imports(app_dir / "app.py")
+        crit_ms = measure(critical, app_dir)
+        status = "OK " if crit_ms <= budget else "NG "
+        failed |= crit_ms > budget
+        print(f"{status} {app}: critical {crit_ms:,.0f} ms / budget {budget:,.0f} ms")
+        print(f"     critical: {', '.join(critical)}")
+        for m in deferred:
+            try:
+                print(f"     deferred: {m:<24} {measure([m], app_dir):>8,.0f} ms")
+            except RuntimeError as e:
+                print(f"     deferred: {m:<24} (not importable: {e})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+Streamlit アプリの負荷試験ハーネス
+
+Streamlit の AppTest でアプリをヘッドレス実行し、N 人の仮想ユーザーが同一プロセス内で
+並行してスライダー変更・モード切替を行ったときの再実行 (rerun) レイテンシを計測する。
+1 プロセスあたり何人まで捌けるかのキャパシティ計画に使う。
+
+出力: rerun レイテンシの p50 / p95 / p99、rerun あたりの CPU 時間、ユーザーあたりの RSS 増分
+
+使い方:
+    python tools/loadtest.py --scenario ec-3plan --users 20 --iterations 10
+    python tools/loadtest.py --scenario all --users 10 --json loadtest.json
+"""
+import argparse
+import json
+import logging
+import random
+import resource
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+# ══════════════════════════════════════════════
+# Widget helpers
+# ══════════════════════════════════════════════
+def _widget(at, kind, label=None, key=None):
+    for w in getattr(at, kind):
+        if (key is not None and w.key == key) or (label is not None and w.label == label):
+            return w
+    raise LookupError(f"{kind} not found: {label or key}")
+
+
+def _set_slider(label=None, key=None):
+    def action(at, rng):
+        w = _widget(at, "slider", label, key)
+        steps = round((w.max - w.min) / w.step)
+        w.set_value(round(w.min + rng.randint(0, steps) * w.step, 6))
+    action.__name__ = f"slider:{label or key}"
+    return action
+
+
+def _set_number(label, lo, hi, step):
+    def action(at, rng):
+        _widget(at, "number_input", label).set_value(lo + rng.randint(0, (hi - lo) // step) * step)
+    action.__name__ = f"number:{label}"
+    return action
+
+
+def _toggle_mode(at, rng):
+    w = _widget(at, "radio", "モード選択")
+    w.set_value(rng.choice(w.options))
+
+
+def _toggle_mall(at, rng):
+    # 既定ではすべてオンなので、check() ではなく反転させて実際に入力を変える
+    w = _widget(at, "checkbox", key=rng.choice(["use_amazon", "use_rakuten", "use_yahoo"]))
+    w.set_value(not w.value)
+
+
+def _set_mode(value):
+    def setup(at):
+        _widget(at, "radio", "モード選択").set_value(value).run()
+    return setup
+
+
+def _enable_inventory(n_skus):
+    def setup(at):
+        _widget(at, "checkbox", key="inv_enabled").check().run()
+        _widget(at, "number_input", "SKU数").set_value(n_skus).run()
+    return setup
+
+
+def _login(at):
+    at.text_input[0].input("password123")
+    at.button[0].click().run()
+
+
+EC_COMMON = [
+    _set_slider("原価率"), _set_slider("基礎転換率"),
+    _set_number("月間広告予算 (円)", 100_000, 2_000_000, 50_000),
+    _set_number("現状月商 (円)", 1_000_000, 20_000_000, 100_000),
+]
+
+# シナリオ: app = 対象アプリ, setup = 初回描画後の準備, actions = rerun ごとにランダムに 1 つ実行
+SCENARIOS = {
+    "ec-single": {
+        "app": "ec-simulator", "setup": [],
+        "actions": EC_COMMON + [_toggle_mall],
+    },
+    "ec-3plan": {
+        "app": "ec-simulator", "setup": [_set_mode("3プラン比較モード")],
+        "actions": EC_COMMON + [_set_slider(key="g_ad"), _set_slider(key="p_cvr"), _set_slider(key="s_trf")],
+    },
+    "ec-large-sku": {
+        "app": "ec-simulator", "setup": [_set_mode("3プラン比較モード"), _enable_inventory(20_000)],
+        "actions": EC_COMMON + [_set_slider(key="g_ad"), _set_slider("発注点 (ヶ月分)")],
+    },
+    "ec-mixed": {
+        "app": "ec-simulator", "setup": [],
+        "actions": EC_COMMON + [_toggle_mode, _toggle_mall, _set_slider(key="g_ad")],
+    },
+    "ga4": {
+        "app": "ga4", "setup": [_login],
+        "actions": [_set_slider("Context Window (days)"), _set_number("Token Budget", 200, 4000, 100)],
+    },
+}
+
+
+# ══════════════════════════════════════════════
+# Measurement
+# ══════════════════════════════════════════════
+def _rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        # psutil が無い環境では最大 RSS で代用 (Linux は KiB 単位)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * q / 100
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+_setup_lock = threading.Lock()
+
+
+def _share_script_cache():
+    """AppTest は rerun ごとに ScriptCache を作り直してスクリプトを再コンパイルする。
+
+    実サーバーでは Runtime が 1 つの ScriptCache を全セッションで共有するので、それに合わせる
+    （毎回のコンパイル時間がレイテンシに混ざるのを防ぎ、並行コンパイルによる不安定さも避ける）。
+    """
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    shared = ScriptCache()
+    local_script_runner.ScriptCache = lambda: shared
+
+
+def _apply_random_action(at, actions, rng):
+    """現在の画面に存在するウィジェットを対象とするアクションを 1 つ実行する"""
+    for action in rng.sample(actions, len(actions)):
+        try:
+            action(at, rng)
+            return action.__name__
+        except LookupError:
+            continue  # 例: 単一プランモードではプラン設定スライダーが存在しない
+    raise LookupError("no applicable action")
+
+
+def _virtual_user(scenario, uid, iterations, think_ms, seed, timeout, barrier, latencies, errors):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed + uid)
+    at = AppTest.from_file(str(ROOT / scenario["app"] / "app.py"), default_timeout=timeout)
+    try:
+        # セッション確立（初回描画・セットアップ）は直列に行い、計測対象の rerun だけを並行させる
+        with _setup_lock:
+            at.run()
+            for setup in scenario["setup"]:
+                setup(at)
+    finally:
+        barrier.wait()  # 全ユーザーのセッション確立後に一斉に操作を開始する
+    for _ in range(iterations):
+        name = "?"
+        try:
+            name = _apply_random_action(at, scenario["actions"], rng)
+            t0 = time.perf_counter()
+            at.run()
+            latencies.append(time.perf_counter() - t0)
+            if at.exception:
+                errors.append(f"user{uid} {name}: {at.exception[0].message}")
+        except Exception as e:
+            errors.append(f"user{uid} {name}: {e}")
+        if think_ms:
+            time.sleep(rng.uniform(0, think_ms) / 1000)
+
+
+_warmed = set()
+
+
+def _warm_up(app, timeout):
+    """ライブラリの import 分が最初のシナリオの RSS・CPU に乗らないよう、アプリを 1 度空実行する"""
+    if app in _warmed:
+        return
+    from streamlit.testing.v1 import AppTest
+    AppTest.from_file(str(ROOT / app / "app.py"), default_timeout=timeout).run()
+    _warmed.add(app)
+
+
+def run_scenario(name, users, iterations, think_ms=0, seed=0, timeout=120):
+    scenario = SCENARIOS[name]
+    _warm_up(scenario["app"], timeout)
+    latencies, errors = [], []
+    barrier = threading.Barrier(users)
+    rss0 = _rss_mb()
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        futures = [pool.submit(_virtual_user, scenario, uid, iterations, think_ms, seed,
+                               timeout, barrier, latencies, errors) for uid in range(users)]
+        for f in futures:
+            f.result()
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    rss = _rss_mb()
+    reruns = max(len(latencies), 1)
+    return {
+        "scenario": name,
+        "app": scenario["app"],
+        "users": users,
+        "reruns": len(latencies),
+        "errors": len(errors),
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies, default=0) * 1000,
+        "throughput_rps": len(latencies) / wall if wall > 0 else 0,
+        # 初回描画・セットアップ分も含めたプロセス CPU 時間を rerun 数で按分
+        "cpu_ms_per_rerun": cpu / reruns * 1000,
+        "cpu_util": cpu / wall if wall > 0 else 0,
+        "rss_mb": rss,
+        "rss_mb_per_user": (rss - rss0) / users,
+        "error_samples": errors[:5],
+    }
+
+
+def _print(result):
+    r = result
+    print(f"[{r['scenario']}] users={r['users']} reruns={r['reruns']} errors={r['errors']}")
+    print(f"  latency   p50 {r['p50_ms']:8.1f} ms   p95 {r['p95_ms']:8.1f} ms   "
+          f"p99 {r['p99_ms']:8.1f} ms   max {r['max_ms']:8.1f} ms")
+    print(f"  cpu       {r['cpu_ms_per_rerun']:8.1f} ms/rerun   util {r['cpu_util']:.2f} cores   "
+          f"throughput {r['throughput_rps']:.1f} rerun/s")
+    print(f"  memory    rss {r['rss_mb']:8.1f} MB   +{r['rss_mb_per_user']:.2f} MB/user")
+    for e in r["error_samples"]:
+        print(f"  ! {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streamlit アプリの負荷試験")
+    parser.add_argument("--scenario", default="ec-3plan", choices=list(SCENARIOS) + ["all"])
+    parser.add_argument("--users", type=int, default=10, help="同時ユーザー数")
+    parser.add_argument("--iterations", type=int, default=10, help="ユーザーあたりの rerun 回数")
+    parser.add_argument("--think-ms", type=float, default=0, help="操作間の最大待ち時間 (ms)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120, help="rerun 1 回のタイムアウト (秒)")
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    logging.disable(logging.WARNING)  # AppTest の bare mode 警告を抑制
+
+    _share_script_cache()
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = []
+    for name in names:
+        result = run_scenario(name, args.users, args.iterations, args.think_ms, args.seed, args.timeout)
+        _print(result)
+        results.append(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())